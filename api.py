@@ -0,0 +1,409 @@
+import argparse
+import datetime
+import json
+import os
+import re
+import sys
+from concurrent.futures import wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import db
+
+# 设置环境变量 DIARY_API_TOKEN 后，请求需要带上 Authorization: Bearer <token>
+API_TOKEN = os.environ.get("DIARY_API_TOKEN")
+
+# 请求体的最大字节数
+MAX_BODY = 32 * 1024 * 1024
+
+# 列表每页的默认和最大条数
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 1000
+
+# 批量请求最多包含的操作数
+MAX_BATCH = 10000
+
+# 日记字段（顺序与 db.ENTRY_COLUMNS 对应）
+ENTRY_FIELDS = ["id", "date", "title", "content", "mood", "tags", "updated_at"]
+
+# 修改日记时可以提供的字段
+UPDATE_FIELDS = ["title", "content", "mood", "tags"]
+
+# 批量请求中的写操作（其余为读操作）
+WRITE_OPERATIONS = {"add", "update", "delete"}
+
+
+# 请求参数有误
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# 日记转换为 JSON 对象，列表中的正文为预览
+def entry_json(row, content_field="content"):
+    if row is None:
+        return None
+    entry = dict(zip(ENTRY_FIELDS, row))
+    entry[content_field] = entry.pop("content")
+    return entry
+
+
+# 检查日期格式（YYYY-MM-DD）
+def parse_date(value, name="date"):
+    try:
+        return datetime.date.fromisoformat(str(value)).isoformat()
+    except ValueError:
+        raise ApiError(400, f"{name} 不是有效的日期：{value}")
+
+
+# 取出必填字段
+def require(data, name):
+    value = data.get(name)
+    if value is None or value == "":
+        raise ApiError(400, f"缺少 {name}")
+    return value
+
+
+# 文本字段：null 视为空字符串，数字等转换为字符串，对象和数组返回 400
+def text(value, name):
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        raise ApiError(400, f"{name} 应为字符串")
+    return str(value)
+
+
+# 标签：字符串，或字符串数组（与导入时的 bulk.normalize_record 相同，用 ", " 连接）
+def parse_tags(value):
+    if isinstance(value, list):
+        return ", ".join(text(tag, "tags") for tag in value)
+    return text(value, "tags")
+
+
+# 心情：去掉首尾空白，不能为空（日历上显示心情的第一个词）
+def parse_mood(value):
+    mood = text(value, "mood").strip()
+    if not mood:
+        raise ApiError(400, "mood 不能为空")
+    return mood
+
+
+# 筛选条件（心情、标签）：查询参数中为列表，批量请求中可以是一个字符串或字符串数组
+def parse_list(value, name):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ApiError(400, f"{name} 应为字符串或字符串数组")
+    return value
+
+
+# 每页条数：1 到 MAX_LIMIT 之间
+def parse_limit(value):
+    try:
+        return max(1, min(int(value), MAX_LIMIT))
+    except (TypeError, ValueError):
+        raise ApiError(400, f"limit 不是有效的数字：{value}")
+
+
+# 新日记的字段：(date, title, content, mood, tags)
+def new_entry_fields(data):
+    return (parse_date(require(data, "date")), text(data.get("title"), "title"), text(require(data, "content"), "content"),
+            parse_mood(require(data, "mood")), parse_tags(data.get("tags")))
+
+
+# 修改日记时提供的字段：{字段: 新值}，没有提供的字段不在其中
+def update_fields(data):
+    parsers = {"mood": parse_mood, "tags": parse_tags}
+    return {name: parsers[name](data[name]) if name in parsers else text(data[name], name)
+            for name in UPDATE_FIELDS if name in data}
+
+
+# 修改日记（在写线程中执行）：在同一个事务中读取原值并合并，没有提供的字段保持原值
+# 同一批中对同一篇日记的多次修改依次生效，不会互相覆盖
+def _patch_entry(conn, entry_id, fields):
+    row = conn.execute(f"SELECT title, {db._full_content_sql('entries')}, mood, tags FROM entries WHERE id = ?",
+                       (entry_id,)).fetchone()
+    if row is None:
+        raise ApiError(404, f"日记 {entry_id} 不存在")
+    merged = dict(zip(UPDATE_FIELDS, row), **fields)
+    db._update_entry(conn, entry_id, *(merged[name] for name in UPDATE_FIELDS))
+
+
+# 提交修改日记，返回 Future
+def patch_entry_async(entry_id, data):
+    return db.submit_write(_patch_entry, entry_id, update_fields(data))
+
+
+# 按筛选条件分页列出日记，next 为下一页的游标
+def list_page(params):
+    start = parse_date(params.get("start", "0001-01-01"), "start")
+    end = parse_date(params.get("end", "9999-12-31"), "end")
+    moods = parse_list(params.get("mood"), "mood")
+    tags = parse_list(params.get("tag"), "tag") or None
+    match_all = params.get("match") == "all"
+    limit = parse_limit(params.get("limit", DEFAULT_LIMIT))
+    after = None
+    if params.get("after_date") and params.get("after_id"):
+        after = (parse_date(params["after_date"], "after_date"), int(params["after_id"]))
+
+    rows = db.list_entries(start, end, moods, tags, match_all, after=after, limit=limit + 1)
+    page = rows[:limit]
+    result = {"entries": [entry_json(row, "preview") for row in page], "next": None}
+    if len(rows) > limit:
+        result["next"] = {"after_date": page[-1][1], "after_id": page[-1][0]}
+    if params.get("count") == "1":
+        result["total"] = db.count_entries(start, end, moods, tags, match_all)
+    return result
+
+
+# 执行批量请求中的一个操作：读操作直接返回结果，写操作返回 Future
+def start_operation(op):
+    kind = op.get("op")
+    if kind == "add":
+        return db.add_entry_async(*new_entry_fields(op))
+    if kind == "update":
+        return patch_entry_async(int(require(op, "id")), op)
+    if kind == "delete":
+        return db.delete_entry_async(int(require(op, "id")))
+    if kind == "get":
+        return entry_json(db.get_entry(int(require(op, "id"))))
+    if kind == "get_by_date":
+        return entry_json(db.get_entry_by_date(parse_date(require(op, "date"))))
+    if kind == "search":
+        return [entry_json(row[:6] + row[7:], "preview") | {"snippet": row[6]}
+                for row in db.search_entries(text(require(op, "q"), "q"), parse_limit(op.get("limit", DEFAULT_LIMIT)))]
+    if kind == "list":
+        return list_page(op)
+    raise ApiError(400, f"未知的操作：{kind}")
+
+
+# 批量执行：连续的写操作全部提交后再等待结果，由写线程合并到少数几个事务中
+# 读操作执行前先等待之前提交的写操作完成，所以按顺序执行的效果相同：读到的是前面写操作之后的数据
+# 每个操作单独成功或失败，结果按顺序返回
+def run_batch(operations):
+    if not isinstance(operations, list):
+        raise ApiError(400, "operations 必须是数组")
+    if len(operations) > MAX_BATCH:
+        raise ApiError(400, f"一次最多 {MAX_BATCH} 个操作")
+
+    pending = []
+    writes = []
+    for op in operations:
+        try:
+            if not isinstance(op, dict):
+                raise ApiError(400, "操作必须是对象")
+            if op.get("op") not in WRITE_OPERATIONS and writes:
+                wait(writes)
+                writes = []
+            value = start_operation(op)
+            if hasattr(value, "result"):
+                writes.append(value)
+            pending.append((True, value))
+        except Exception as e:
+            pending.append((False, e))
+
+    results = []
+    for ok, value in pending:
+        if ok and hasattr(value, "result"):
+            try:
+                value = value.result()
+            except Exception as e:
+                ok = False
+                value = e
+        if ok:
+            results.append({"ok": True, "result": value})
+        else:
+            if isinstance(value, ApiError):
+                status = value.status
+            else:
+                status = 400 if isinstance(value, (ValueError, TypeError)) else 500
+            results.append({"ok": False, "status": status, "error": str(value)})
+    return {"results": results}
+
+
+# 按 id 获取日记
+def _get_entry(match, params, body):
+    entry = db.get_entry(int(match.group(1)))
+    if entry is None:
+        raise ApiError(404, "日记不存在")
+    return entry_json(entry)
+
+
+# 按日期获取日记
+def _get_entry_by_date(match, params, body):
+    entry = db.get_entry_by_date(parse_date(match.group(1)))
+    if entry is None:
+        raise ApiError(404, "这一天没有日记")
+    return entry_json(entry)
+
+
+# 添加日记
+def _add_entry(match, params, body):
+    return {"id": db.add_entry(*new_entry_fields(body))}
+
+
+# 修改日记（只修改提供的字段）
+def _update_entry(match, params, body):
+    entry_id = int(match.group(1))
+    patch_entry_async(entry_id, body).result()
+    return {"id": entry_id}
+
+
+# 删除日记
+def _delete_entry(match, params, body):
+    entry_id = int(match.group(1))
+    if db.get_entry(entry_id) is None:
+        raise ApiError(404, "日记不存在")
+    db.delete_entry(entry_id)
+    return {"id": entry_id}
+
+
+# 搜索日记
+def _search(match, params, body):
+    return start_operation(dict(params, op="search"))
+
+
+# 分页列出日记
+def _list(match, params, body):
+    return list_page(params)
+
+
+# 批量操作
+def _batch(match, params, body):
+    return run_batch(body.get("operations"))
+
+
+# 服务状态
+def _health(match, params, body):
+    return {"ok": True, "entries": db.get_date_bounds()[2]}
+
+
+# 路由：(方法, 路径正则, 处理函数)，处理函数接收 (路径匹配, 查询参数, 请求体)
+ROUTES = [
+    ("GET", re.compile(r"^/health$"), _health),
+    ("GET", re.compile(r"^/entries$"), _list),
+    ("POST", re.compile(r"^/entries$"), _add_entry),
+    ("GET", re.compile(r"^/entries/(\d+)$"), _get_entry),
+    ("PUT", re.compile(r"^/entries/(\d+)$"), _update_entry),
+    ("PATCH", re.compile(r"^/entries/(\d+)$"), _update_entry),
+    ("DELETE", re.compile(r"^/entries/(\d+)$"), _delete_entry),
+    ("GET", re.compile(r"^/entries/by-date/([\d-]+)$"), _get_entry_by_date),
+    ("GET", re.compile(r"^/search$"), _search),
+    ("POST", re.compile(r"^/batch$"), _batch),
+]
+
+# 可以重复的查询参数
+LIST_PARAMS = {"mood", "tag"}
+
+
+# 请求处理：每个连接一个线程，HTTP/1.1 保持连接，数据库访问与界面共用 db 模块
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "DiaryAPI/1.0"
+
+    def _send(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY:
+            raise ApiError(413, "请求体过大")
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise ApiError(400, "请求体不是有效的 JSON")
+        if not isinstance(body, dict):
+            raise ApiError(400, "请求体必须是 JSON 对象")
+        return body
+
+    def _handle(self, method):
+        try:
+            if API_TOKEN and self.headers.get("Authorization") != f"Bearer {API_TOKEN}":
+                raise ApiError(401, "未授权")
+            url = urlsplit(self.path)
+            params = {key: values if key in LIST_PARAMS else values[-1]
+                      for key, values in parse_qs(url.query).items()}
+            body = self._read_body()
+
+            # 多用户模式：用 X-Diary-User 请求头或 user 参数选择用户的数据库
+            # API_TOKEN 是所有用户共用的，持有它就能访问任何用户的日记，这里不验证用户身份
+            if db.SHARDS_DIR:
+                user = self.headers.get("X-Diary-User") or params.get("user")
+                if not user:
+                    raise ApiError(400, "多用户模式下需要 X-Diary-User 请求头")
+                db.use_shard(user)
+            else:
+                db.select_database(None)
+
+            for route_method, pattern, handler in ROUTES:
+                match = pattern.match(url.path)
+                if match and route_method == method:
+                    self._send(200, handler(match, params, body))
+                    return
+            raise ApiError(404, "没有这个接口")
+        except ApiError as e:
+            self._send(e.status, {"error": str(e)})
+        except (ValueError, TypeError) as e:
+            self._send(400, {"error": str(e)})
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    # 默认每个请求都写一行日志，批量调用时太多
+    def log_message(self, format, *args):
+        pass
+
+
+# 创建服务器（端口为 0 时由系统分配）
+def make_server(host="127.0.0.1", port=8765):
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    server.daemon_threads = True
+    return server
+
+
+# 命令行入口
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="日记本 JSON 接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--db", default=db.DB_PATH, help="数据库文件")
+    args = parser.parse_args(argv)
+    db.use_database(args.db)
+    db.init_db()
+
+    server = make_server(args.host, args.port)
+    print(f"日记本接口已启动：http://{args.host}:{server.server_address[1]}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
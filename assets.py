@@ -0,0 +1,87 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+
+from PIL import Image
+
+# 图标原图（高分辨率）和输出尺寸
+ICONS = {"icon-192.png": 192, "icon-512.png": 512}
+
+# 生成的文件放在这个文件夹，由 server.py 提供
+OUTPUT_DIR = "static"
+
+# 生成文件的清单：原图名 → 带版本号的文件名
+ASSET_MAP = "assets.json"
+
+# 调色板颜色数：图标是扁平插画，256 色和原图看不出区别，文件小得多
+PALETTE_COLORS = 256
+
+
+# 缩放到目标尺寸并转为调色板 PNG，返回文件内容
+def build_icon(source, size):
+    with Image.open(source) as image:
+        image = image.convert("RGBA").resize((size, size), Image.Resampling.LANCZOS)
+    image = image.quantize(PALETTE_COLORS, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+    output = io.BytesIO()
+    image.save(output, "PNG", optimize=True)
+    return output.getvalue()
+
+
+# 带版本号的文件名：内容变化时文件名随之变化，浏览器可以永久缓存
+def versioned_name(name, data):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+
+
+# 读取生成文件的清单（还没有生成时为空）
+def load_asset_map(output_dir=OUTPUT_DIR):
+    try:
+        with open(os.path.join(output_dir, ASSET_MAP), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# 生成所有图标，删除旧版本的文件，写入清单；返回 [(原图, 输出文件, 原大小, 新大小)]
+def build(source_dir=".", output_dir=OUTPUT_DIR):
+    os.makedirs(output_dir, exist_ok=True)
+    old_files = set(load_asset_map(output_dir).values())
+    asset_map = {}
+    report = []
+    for name, size in ICONS.items():
+        source = os.path.join(source_dir, name)
+        data = build_icon(source, size)
+        target = versioned_name(name, data)
+        with open(os.path.join(output_dir, target), "wb") as f:
+            f.write(data)
+        asset_map[name] = target
+        report.append((name, target, os.path.getsize(source), len(data)))
+
+    for old in old_files - set(asset_map.values()):
+        if os.path.exists(os.path.join(output_dir, old)):
+            os.remove(os.path.join(output_dir, old))
+    with open(os.path.join(output_dir, ASSET_MAP), "w", encoding="utf-8") as f:
+        json.dump(asset_map, f, ensure_ascii=False, indent=2)
+    return report
+
+
+# 命令行入口
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成 PWA 图标（缩放、压缩、带版本号的文件名）")
+    parser.add_argument("--source-dir", default=".", help="图标原图所在的文件夹")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    args = parser.parse_args(argv)
+
+    report = build(args.source_dir, args.output_dir)
+    for name, target, before, after in report:
+        print(f"{name:<14} → {target:<28} {before / 1024:>8.1f} KB → {after / 1024:>6.1f} KB", file=sys.stderr)
+    before = sum(item[2] for item in report)
+    after = sum(item[3] for item in report)
+    print(f"{'合计':<44} {before / 1024:>8.1f} KB → {after / 1024:>6.1f} KB", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
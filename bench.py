@@ -0,0 +1,360 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+
+import db
+import bulk
+import related
+
+# 内置的八种心情及其出现权重
+MOODS = ["😊 开心", "😄 兴奋", "😌 平静", "😢 难过", "😠 生气", "😔 忧郁", "😴 疲惫", "🤔 思考"]
+MOOD_WEIGHTS = [25, 8, 30, 10, 5, 7, 10, 5]
+
+# 生成正文用的词语
+SUBJECTS = ["今天", "早上", "下午", "晚上", "周末", "最近", "这几天", "上班路上", "回家以后", "吃饭的时候"]
+PLACES = ["公司", "家里", "公园", "咖啡馆", "图书馆", "地铁上", "学校", "海边", "山上", "老家", "超市", "医院"]
+PEOPLE = ["朋友", "同事", "妈妈", "爸爸", "孩子", "老师", "邻居", "同学", "自己", "家人"]
+ACTIONS = ["聊了很久", "一起吃了饭", "散步", "看了一本书", "加班到很晚", "跑步五公里", "整理房间", "学习新技能",
+           "写了一些代码", "看了一部电影", "做了一顿晚饭", "去旅行", "开了一个长会", "发了一会儿呆"]
+FEELINGS = ["心情很好", "有点累", "觉得很充实", "有些焦虑", "非常开心", "平静下来了", "想了很多事情", "收获很大",
+            "有点失落", "感到温暖", "期待明天", "决定要坚持下去"]
+
+# 标签池（按 Zipf 分布抽取，少数标签出现得非常频繁）
+TAGS = ["工作", "生活", "家庭", "旅行", "读书", "运动", "美食", "电影", "学习", "感悟", "朋友", "健康", "音乐",
+        "摄影", "理财", "编程", "计划", "回忆", "周末", "节日"] + [f"话题{i}" for i in range(180)]
+TAG_WEIGHTS = [1 / (rank + 1) for rank in range(len(TAGS))]
+
+# 基准测试的重复次数
+REPEAT = 5
+
+# 搜索用的关键词（长词走全文索引，短词走 LIKE）
+SEARCH_TERMS = ["咖啡馆", "跑步五公里", "心情", "Python"]
+
+# 启动耗时测试的页面（第一个是默认页面）
+STARTUP_PAGES = ["写日记", "看日记", "日历视图", "搜索日记", "统计", "导入导出", "关于"]
+
+# 启动耗时探针，每次在新进程中运行（相当于刚启动的服务器：streamlit 已导入，应用的模块都还没有导入）
+# 参数：数据库文件、应用脚本、"import" 或页面名称；输出 [{"op", "ms", "pandas"}]
+STARTUP_PROBE = r'''
+import importlib, json, os, sys, time
+app, mode = sys.argv[2], sys.argv[3]
+sys.path.insert(0, os.path.dirname(app))
+results = []
+
+def timed(op, func):
+    start = time.perf_counter()
+    func()
+    results.append({"op": op, "ms": (time.perf_counter() - start) * 1000, "pandas": "pandas" in sys.modules})
+
+if mode == "import":
+    timed("import", lambda: importlib.import_module(os.path.splitext(os.path.basename(app))[0]))
+else:
+    from streamlit.testing.v1 import AppTest
+    import db
+    db.DB_PATH = sys.argv[1]
+    at = AppTest.from_file(app, default_timeout=120)
+    timed("first_paint", at.run)
+    if at.sidebar.radio[0].value != mode:
+        timed(f"open:{mode}", lambda: at.sidebar.radio[0].set_value(mode).run())
+    timed(f"rerun:{mode}", at.run)
+print(json.dumps(results))
+'''
+
+
+# 生成一句话
+def make_sentence(rng):
+    return (rng.choice(SUBJECTS) + "在" + rng.choice(PLACES) + "和" + rng.choice(PEOPLE) + rng.choice(ACTIONS)
+            + "，" + rng.choice(FEELINGS) + "。")
+
+
+# 生成 n 篇日记（可复现），日期分布在 years 年内
+def generate_entries(n, seed=42, years=5, end_date=datetime.date(2025, 12, 31)):
+    rng = random.Random(seed)
+    span = years * 365
+    for i in range(n):
+        date = end_date - datetime.timedelta(days=rng.randrange(span))
+        # 篇幅长短不一：大多数几百字，少数几千字
+        sentences = int(rng.lognormvariate(3.0, 0.8)) + 1
+        content = "".join(make_sentence(rng) for _ in range(sentences))
+        tags = rng.choices(TAGS, weights=TAG_WEIGHTS, k=rng.randint(0, 4))
+        yield {
+            "date": date.isoformat(),
+            "title": rng.choice(SUBJECTS) + rng.choice(ACTIONS),
+            "content": content,
+            "mood": rng.choices(MOODS, weights=MOOD_WEIGHTS)[0],
+            "tags": ", ".join(dict.fromkeys(tags)),
+        }
+
+
+# 生成（或复用）含 n 篇日记的临时数据库，suffix 用于区分不同的存储方式
+def build_database(n, seed, data_dir, suffix=""):
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"diary_{n}_{seed}{suffix}.db")
+    db.use_database(path)
+    with db.connection() as conn:
+        count = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+    if count < n:
+        start = time.perf_counter()
+        bulk.import_records(generate_entries(n, seed), f"bench:{n}:{seed}", batch_size=5000)
+        print(f"  生成 {n} 篇日记用时 {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return path
+
+
+# 重复执行 func，返回耗时统计（毫秒）
+def measure(func, repeat=REPEAT):
+    times = []
+    rows = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append((time.perf_counter() - start) * 1000)
+        rows = len(result) if hasattr(result, "__len__") else None
+    times.sort()
+    return {
+        "min_ms": round(times[0], 3),
+        "median_ms": round(statistics.median(times), 3),
+        "max_ms": round(times[-1], 3),
+        "rows": rows,
+    }
+
+
+# 原来的读取方式：全部日记连同完整正文读入 DataFrame
+# （db.get_all_entries 现在只返回预览，原来的流程要读出完整正文才能和当时比较）
+def legacy_all_entries():
+    import pandas as pd
+    import daily
+    with db.connection() as conn:
+        rows = conn.execute(f"SELECT {db.ENTRY_COLUMNS} FROM entries ORDER BY date DESC").fetchall()
+    return pd.DataFrame(rows, columns=daily.ENTRY_COLUMNS)
+
+
+# 原来的看日记流程：读取全部日记，用 pandas 筛选
+def legacy_list_pipeline(moods, tags):
+    df = legacy_all_entries()
+    start_date, end_date = df["日期"].min(), df["日期"].max()
+    df = df.copy()
+    df = df[(df["日期"] >= start_date) & (df["日期"] <= end_date) & (df["心情"].isin(moods))]
+    df = df[df["标签"].apply(lambda x: any(tag in (x.split(',') if x else []) for tag in tags))]
+    return df
+
+
+# 原来的搜索流程：读取全部日记，用 str.contains 扫描
+def legacy_search(query):
+    df = legacy_all_entries()
+    return df[df["标题"].str.contains(query, case=False) |
+              df["内容"].str.contains(query, case=False) |
+              df["标签"].str.contains(query, case=False)]
+
+
+# 当前的看日记流程：日期范围、计数和第一页
+def list_pipeline(moods, tags):
+    min_date, max_date, _ = db.get_date_bounds()
+    db.count_entries(min_date, max_date, moods, tags)
+    return db.list_entries(min_date, max_date, moods, tags, limit=20)
+
+
+# 当前数据库上需要计时的操作（查询缓存已关闭，测的是实际查询）
+def hot_paths(rng):
+    import daily
+    bounds = db.get_date_bounds()
+    max_date = datetime.date.fromisoformat(bounds[1])
+    with db.connection() as conn:
+        dates = [row[0] for row in conn.execute("SELECT date FROM daily_summary ORDER BY date").fetchall()]
+    sample_dates = [rng.choice(dates) for _ in range(20)]
+    sample_ids = [db.get_entry_by_date(d)[0] for d in sample_dates]
+    # 先建立相关日记索引，只计时查询
+    related.related_entries(sample_ids[0])
+    moods = MOODS[:3]
+    tags = ["旅行", "读书"]
+
+    paths = {
+        "get_all_entries": lambda: db.get_all_entries(),
+        "legacy_list_pipeline": lambda: legacy_list_pipeline(moods, tags),
+        "list_pipeline": lambda: list_pipeline(moods, tags),
+        "generate_calendar": lambda: daily.generate_calendar(max_date.year, max_date.month),
+        "generate_year_heatmap": lambda: daily.generate_year_heatmap(max_date.year),
+        "get_entry_by_date": lambda: [db.get_entry_by_date(d) for d in sample_dates],
+        "related_entries": lambda: [related.related_entries(i) for i in sample_ids],
+    }
+    for term in SEARCH_TERMS:
+        paths[f"legacy_search[{term}]"] = lambda term=term: legacy_search(term)
+        paths[f"search_entries[{term}]"] = lambda term=term: db.search_entries(term, limit=50)
+    return paths
+
+
+# 当前 git 提交（用于区分不同版本的结果）
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# 运行全部基准测试
+def run(sizes, seed=42, data_dir="bench_data", repeat=REPEAT, only=None):
+    # 关闭查询缓存
+    db.CACHE_SIZE = 0
+    results = []
+    for n in sizes:
+        print(f"{n} 篇日记：", file=sys.stderr)
+        build_database(n, seed, data_dir)
+        rng = random.Random(seed)
+        for name, func in hot_paths(rng).items():
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            stats = measure(func, repeat)
+            results.append(dict(size=n, op=name, **stats))
+            print(f"  {name:<32} {stats['median_ms']:>10.2f} ms", file=sys.stderr)
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "seed": seed,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+# 数据库文件大小（先把 WAL 写回数据库文件）
+def database_size(path):
+    with db.connection() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(path)
+
+
+# 比较不压缩和压缩存储正文时的数据库大小和读取耗时
+def compression_report(sizes, seed=42, data_dir="bench_data", repeat=REPEAT):
+    db.CACHE_SIZE = 0
+    threshold = db.COMPRESS_THRESHOLD or 1024
+    results = []
+    try:
+        for n in sizes:
+            for mode, mode_threshold in (("plain", 0), ("zlib", threshold)):
+                db.COMPRESS_THRESHOLD = mode_threshold
+                path = build_database(n, seed, data_dir, f"_{mode}")
+                results.append({"size": n, "mode": mode, "op": "file_size_mb",
+                                "median_ms": round(database_size(path) / 1024 / 1024, 2)})
+                rng = random.Random(seed)
+                max_id = db.get_date_bounds()[2]
+                sample_ids = [rng.randint(1, max_id) for _ in range(20)]
+                paths = {
+                    "get_all_entries": lambda: db.get_all_entries(),
+                    "list_pipeline": lambda: list_pipeline(MOODS[:3], ["旅行", "读书"]),
+                    "search_entries[咖啡馆]": lambda: db.search_entries("咖啡馆", limit=50),
+                    "search_entries[心情]": lambda: db.search_entries("心情", limit=50),
+                    "get_entry": lambda: [db.get_entry(i) for i in sample_ids],
+                }
+                for name, func in paths.items():
+                    results.append(dict(size=n, mode=mode, op=name, **measure(func, repeat)))
+    finally:
+        db.COMPRESS_THRESHOLD = threshold
+
+    # 每个操作一行：不压缩、压缩和比值（file_size_mb 一行为文件大小）
+    by_key = {(r["size"], r["op"], r["mode"]): r["median_ms"] for r in results}
+    print(f"{'size':>8} {'op':<24} {'plain':>10} {'zlib':>10} {'ratio':>7}")
+    for n in sizes:
+        for op in dict.fromkeys(r["op"] for r in results if r["size"] == n):
+            plain, packed = by_key[(n, op, "plain")], by_key[(n, op, "zlib")]
+            ratio = packed / plain if plain else float("inf")
+            print(f"{n:>8} {op:<24} {plain:>10.2f} {packed:>10.2f} {ratio:>6.2f}x")
+    return {"meta": {"commit": git_commit(), "sqlite": sqlite3.sqlite_version, "seed": seed,
+                     "repeat": repeat, "compress_threshold": threshold},
+            "results": results}
+
+
+# 启动和重跑耗时：应用模块的导入、首次渲染、在新进程中第一次打开各页面，以及之后的重跑
+# app 可以指向旧版本的 daily.py，结果用 --compare 对比
+def startup_report(sizes, seed=42, data_dir="bench_data", repeat=REPEAT, app="daily.py"):
+    app = os.path.abspath(app)
+    samples = {}
+    for n in sizes:
+        path = os.path.abspath(build_database(n, seed, data_dir))
+        db.close_all()
+        for _ in range(repeat):
+            for mode in ["import"] + STARTUP_PAGES:
+                output = subprocess.run([sys.executable, "-c", STARTUP_PROBE, path, app, mode], capture_output=True,
+                                        text=True, cwd=os.path.dirname(app), check=True).stdout
+                for item in json.loads(output.splitlines()[-1]):
+                    samples.setdefault((n, "startup:" + item["op"]), []).append(item)
+
+    results = []
+    for (n, op), items in samples.items():
+        times = sorted(item["ms"] for item in items)
+        results.append({"size": n, "op": op, "min_ms": round(times[0], 3), "median_ms": round(statistics.median(times), 3),
+                        "max_ms": round(times[-1], 3), "pandas_loaded": any(item["pandas"] for item in items)})
+        print(f"{n:>8} {op:<28} {results[-1]['median_ms']:>10.2f} ms  pandas={'是' if results[-1]['pandas_loaded'] else '否'}",
+              file=sys.stderr)
+    return {"meta": {"commit": git_commit(), "app": app, "python": platform.python_version(), "seed": seed, "repeat": repeat},
+            "results": results}
+
+
+# 与之前的结果比较，打印中位数的变化
+def compare(current, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["size"], r["op"]): r for r in json.load(f)["results"]}
+    print(f"{'size':>8} {'op':<32} {'before':>10} {'after':>10} {'ratio':>7}")
+    for r in current["results"]:
+        old = baseline.get((r["size"], r["op"]))
+        if old:
+            ratio = r["median_ms"] / old["median_ms"] if old["median_ms"] else float("inf")
+            print(f"{r['size']:>8} {r['op']:<32} {old['median_ms']:>10.2f} {r['median_ms']:>10.2f} {ratio:>6.2f}x")
+
+
+# 命令行入口
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="日记本性能基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--data-dir", default="bench_data", help="存放生成的数据库")
+    parser.add_argument("--only", nargs="+", help="只运行名称以这些前缀开头的操作")
+    parser.add_argument("--out", default="bench_results.json", help="结果文件（JSON）")
+    parser.add_argument("--compare", help="与之前的结果文件比较")
+    parser.add_argument("--generate-only", action="store_true", help="只生成数据库，不计时")
+    parser.add_argument("--compression", action="store_true", help="比较压缩存储正文前后的数据库大小和读取耗时")
+    parser.add_argument("--startup", action="store_true", help="测量应用的导入、首次渲染和各页面的重跑耗时")
+    parser.add_argument("--app", default="daily.py", help="--startup 测量的应用脚本")
+    args = parser.parse_args(argv)
+
+    if args.compression:
+        report = compression_report(args.sizes, args.seed, args.data_dir, args.repeat)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return
+
+    if args.startup:
+        report = startup_report(args.sizes, args.seed, args.data_dir, args.repeat, args.app)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        if args.compare:
+            compare(report, args.compare)
+        return
+
+    if args.generate_only:
+        for n in args.sizes:
+            print(build_database(n, args.seed, args.data_dir))
+        return
+
+    report = run(args.sizes, args.seed, args.data_dir, args.repeat, args.only)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.out}", file=sys.stderr)
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
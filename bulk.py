@@ -0,0 +1,243 @@
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import os
+import sys
+import time
+
+import db
+
+# 每个事务写入的日记数
+BATCH_SIZE = 1000
+
+# 导入数据缺少心情时使用的默认值
+DEFAULT_MOOD = "😌 平静"
+
+# 导出字段
+EXPORT_FIELDS = ["id", "date", "title", "content", "mood", "tags"]
+
+# 导入时接受的字段名（英文或中文列名）
+FIELD_ALIASES = {
+    "date": "date", "日期": "date",
+    "title": "title", "标题": "title",
+    "content": "content", "内容": "content", "body": "content",
+    "mood": "mood", "心情": "mood",
+    "tags": "tags", "标签": "tags",
+}
+
+
+# 把一条原始记录整理成 (date, title, content, mood, tags)，无法导入时返回 None
+def normalize_record(record):
+    fields = {}
+    for key, value in record.items():
+        name = FIELD_ALIASES.get(str(key).strip().lower()) or FIELD_ALIASES.get(str(key).strip())
+        if name and value is not None:
+            fields[name] = value
+
+    content = str(fields.get("content", "")).strip()
+    if not content:
+        return None
+    try:
+        date = datetime.date.fromisoformat(str(fields.get("date", "")).strip()[:10]).isoformat()
+    except ValueError:
+        return None
+
+    tags = fields.get("tags", "")
+    if isinstance(tags, (list, tuple)):
+        tags = ", ".join(str(tag) for tag in tags)
+    return (date, str(fields.get("title", "")).strip(), content,
+            str(fields.get("mood", "")).strip() or DEFAULT_MOOD, str(tags).strip())
+
+
+# 逐行读取 JSONL
+def read_jsonl(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+# 逐行读取 CSV（第一行为列名）
+def read_csv(f):
+    yield from csv.DictReader(f)
+
+
+# 解析一篇 Markdown 日记：可选的 --- 头部（date/mood/tags/title），标题取第一个 # 标题或文件名
+def parse_markdown(name, text):
+    record = {}
+    lines = text.splitlines()
+    if lines and lines[0].strip() == "---":
+        for i, line in enumerate(lines[1:], start=1):
+            if line.strip() == "---":
+                lines = lines[i + 1:]
+                break
+            key, _, value = line.partition(":")
+            record[key.strip()] = value.strip()
+
+    stem = os.path.splitext(os.path.basename(name))[0]
+    if "date" not in record and "日期" not in record:
+        record["date"] = stem[:10]
+    if "title" not in record and "标题" not in record:
+        record["title"] = stem[11:] if stem[:10] == record.get("date") else stem
+        for i, line in enumerate(lines):
+            if line.startswith("# "):
+                record["title"] = line[2:].strip()
+                del lines[i]
+                break
+    record["content"] = "\n".join(lines).strip()
+    return record
+
+
+# 按文件名顺序读取文件夹中的 Markdown 日记（顺序固定，便于断点续传）
+def read_markdown_dir(path):
+    for name in sorted(os.listdir(path)):
+        if name.lower().endswith((".md", ".markdown")):
+            with open(os.path.join(path, name), encoding="utf-8") as f:
+                yield parse_markdown(name, f.read())
+
+
+# 读取导入进度（已处理的记录数）
+def get_import_progress(source):
+    with db.connection() as conn:
+        row = conn.execute("SELECT done FROM import_progress WHERE source = ?", (source,)).fetchone()
+    return row[0] if row else 0
+
+
+# 写入一批日记和导入进度（在写线程的事务中执行）
+def _write_batch(conn, rows, source, done, now):
+    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM entries").fetchone()[0]
+    conn.executemany('''INSERT INTO entries (date, title, content, content_z, preview, mood, tags, updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                     [(date, title, *db.pack_content(content), mood, tags, now) for date, title, content, mood, tags in rows])
+    # 新日记的 id 按插入顺序递增，与 rows 一一对应
+    new_ids = [row[0] for row in conn.execute("SELECT id FROM entries WHERE id > ? ORDER BY id", (last_id,))]
+    for entry_id, (date, title, content, mood, tags) in zip(new_ids, rows):
+        if tags:
+            db._set_entry_tags(conn, entry_id, tags)
+        db._index_entry(conn, entry_id, None, (title, content, tags))
+    conn.execute("INSERT OR REPLACE INTO import_progress (source, done, updated_at) VALUES (?, ?, ?)",
+                 (source, done, now))
+
+
+# 分批导入记录：每批交给写线程，在一个事务中用 executemany 写入，并记录进度
+# 同一个 source 再次导入时跳过已完成的记录；progress 回调接收 (已处理数, 已导入数, 已跳过数)
+def import_records(records, source, batch_size=BATCH_SIZE, progress=None):
+    done = get_import_progress(source)
+    imported = skipped = 0
+    records = itertools.islice(records, done, None)
+
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            break
+        rows = [normalize_record(record) for record in batch]
+        valid = [row for row in rows if row is not None]
+        now = time.time()
+
+        done += len(batch)
+        db.submit_write(_write_batch, valid, source, done, now).result()
+
+        imported += len(valid)
+        skipped += len(batch) - len(valid)
+        if progress:
+            progress(done, imported, skipped)
+
+    return imported, skipped
+
+
+# 按 id 顺序逐批读取日记，不会一次性加载全部
+def iter_entries(batch_size=BATCH_SIZE):
+    last_id = 0
+    while True:
+        with db.connection() as conn:
+            rows = conn.execute(f"""SELECT id, date, title, {db._full_content_sql('entries')}, mood, tags FROM entries
+                                    WHERE id > ? ORDER BY id LIMIT ?""", (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        yield from rows
+        last_id = rows[-1][0]
+
+
+# 导出为 JSONL，返回导出的日记数
+def export_jsonl(f):
+    count = 0
+    for row in iter_entries():
+        f.write(json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+
+# 导出为 CSV，返回导出的日记数
+def export_csv(f):
+    writer = csv.writer(f)
+    writer.writerow(EXPORT_FIELDS)
+    count = 0
+    for row in iter_entries():
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+# 根据扩展名判断格式
+def guess_format(path):
+    if os.path.isdir(path):
+        return "md"
+    ext = os.path.splitext(path)[1].lower()
+    return {".jsonl": "jsonl", ".json": "jsonl", ".csv": "csv"}.get(ext, "jsonl")
+
+
+# 打开导入源，返回记录迭代器和用于断点续传的来源标识
+def open_source(path, fmt):
+    path = os.path.abspath(path)
+    if fmt == "md":
+        return read_markdown_dir(path), f"md:{path}"
+    f = open(path, encoding="utf-8-sig", newline="")
+    source = f"{fmt}:{path}:{os.path.getsize(path)}"
+    return (read_csv(f) if fmt == "csv" else read_jsonl(f)), source
+
+
+# 命令行入口
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量导入/导出日记")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("import", help="从 JSONL、CSV 或 Markdown 文件夹导入")
+    p_import.add_argument("path")
+    p_import.add_argument("--format", choices=["jsonl", "csv", "md"])
+    p_import.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    p_import.add_argument("--restart", action="store_true", help="忽略之前的进度，从头导入")
+
+    p_export = sub.add_parser("export", help="导出为 JSONL 或 CSV")
+    p_export.add_argument("path")
+    p_export.add_argument("--format", choices=["jsonl", "csv"])
+
+    parser.add_argument("--db", default=db.DB_PATH, help="数据库文件")
+    args = parser.parse_args(argv)
+    db.use_database(args.db)
+
+    if args.command == "import":
+        fmt = args.format or guess_format(args.path)
+        records, source = open_source(args.path, fmt)
+        if args.restart:
+            with db.transaction() as conn:
+                conn.execute("DELETE FROM import_progress WHERE source = ?", (source,))
+        start = time.perf_counter()
+
+        def report(done, imported, skipped):
+            rate = imported / max(time.perf_counter() - start, 1e-9)
+            print(f"\r已处理 {done} 条，导入 {imported} 条，跳过 {skipped} 条（{rate:.0f} 条/秒）", end="", file=sys.stderr)
+
+        imported, skipped = import_records(records, source, args.batch_size, report)
+        print(file=sys.stderr)
+        print(f"导入完成：{imported} 条，跳过 {skipped} 条")
+    else:
+        fmt = args.format or guess_format(args.path)
+        with open(args.path, "w", encoding="utf-8", newline="") as f:
+            count = export_csv(f) if fmt == "csv" else export_jsonl(f)
+        print(f"导出完成：{count} 条")
+
+
+if __name__ == "__main__":
+    main()
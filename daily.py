@@ -1,147 +1,1017 @@
 import streamlit as st
-import sqlite3
 import datetime
-import pandas as pd
+import difflib
 import calendar
+import io
+import json
+import os
+import tempfile
+import hashlib
+import db
+import bulk
+import perf
+import maintenance
+import drafts
 
-# 创建数据库和表
-def create_database():
-    conn = sqlite3.connect('personal_diary.db')
-    c = conn.cursor()
+# pandas、numpy 和 related（依赖 numpy）导入需要约半秒，只在用到它们的函数中导入，
+# 写日记、日历视图和关于等页面的启动和重跑不需要等待
+
+# 星期名称（周一开始）
+WEEKDAY_NAMES = ["周一", "周二", "周三", "周四", "周五", "周六", "周日"]
+
+# 热力图颜色：0 篇、1 篇、2 篇、3 篇及以上
+HEATMAP_COLORS = ["#ebedf0", "#c6e48b", "#7bc96f", "#239a3b"]
+
+# 日记 DataFrame 的列名（与 db.ENTRY_COLUMNS 对应）
+ENTRY_COLUMNS = ["id", "日期", "标题", "内容", "心情", "标签", "修改时间"]
+
+# 心情选项
+MOODS = ["😊 开心", "😄 兴奋", "😌 平静", "😢 难过", "😠 生气", "😔 忧郁", "😴 疲惫", "🤔 思考"]
+
+# 日记编辑控件（控件的 key 为 "<前缀>_<字段>"）
+EDITOR_FIELDS = ["date", "title", "mood", "tags", "content"]
+
+# 心情对应的背景色
+def mood_color(mood):
+    if '开心' in mood or '兴奋' in mood:
+        return '#e3f2fd'
+    if '难过' in mood or '生气' in mood:
+        return '#ffebee'
+    return '#f3e5f5'
+
+# 生成一篇日记卡片的 HTML
+# 只按数据库文件、日记 id、修改时间和显示方式缓存，下划线开头的参数不参与缓存键
+@st.cache_data(max_entries=5000, show_spinner=False)
+def render_card(db_path, entry_id, updated_at, variant, _date, _title, _content, _mood, _tags):
+    parts = ["<div class='diary-entry'>"]
     
-    # 创建日记表
-    c.execute('''CREATE TABLE IF NOT EXISTS entries (
-                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                 date TEXT NOT NULL,
-                 title TEXT NOT NULL,
-                 content TEXT NOT NULL,
-                 mood TEXT NOT NULL,
-                 tags TEXT)''')
+    # 日期和心情
+    parts.append(f"<div class='diary-date'>{_date} <span class='mood-tag' style='background-color:{mood_color(_mood)};'>{_mood}</span></div>")
     
-    conn.commit()
-    conn.close()
-
-# 添加新日记
-def add_entry(date, title, content, mood, tags):
-    conn = sqlite3.connect('personal_diary.db')
-    c = conn.cursor()
+    # 标题
+    parts.append(f"<div class='diary-title'>{_title}</div>")
     
+    # 标签
+    if _tags and isinstance(_tags, str):
+        parts.append("<div style='margin-bottom: 10px;'>")
+        parts.extend(f"<span class='tag'>{tag.strip()}</span>" for tag in _tags.split(','))
+        parts.append("</div>")
+    
+    # 内容
+    parts.append(f"<div class='diary-content'>{_content}</div>")
+    parts.append("</div>")
+    return "".join(parts)
+
+# 把一页日记卡片合并成一个元素输出
+# variant 为 "preview" 时显示内容列（列表中为正文预览），其他值（如搜索词）时显示摘要列
+# 打开单篇日记时用 "full"，与预览卡片分开缓存
+def render_cards(rows, variant="preview"):
+    content_column = "内容" if variant == "preview" else "摘要"
+    cards = [
+        render_card(db.current_path(), int(row["id"]), row["修改时间"], variant,
+                    row["日期"], row["标题"], row[content_column], row["心情"], row["标签"])
+        for _, row in rows.iterrows()
+    ]
+    st.markdown("".join(cards), unsafe_allow_html=True)
+
+# 添加新日记，draft_key 不为 None 时同时删除对应的草稿
+def add_entry(date, title, content, mood, tags, draft_key=None):
     try:
-        c.execute("INSERT INTO entries (date, title, content, mood, tags) VALUES (?, ?, ?, ?, ?)", 
-                  (date, title, content, mood, tags))
-        conn.commit()
+        db.add_entry(date, title, content, mood, tags, draft_key)
         return True
     except Exception as e:
         st.error(f"添加日记失败: {e}")
         return False
-    finally:
-        conn.close()
 
 # 获取所有日记
 def get_all_entries():
-    conn = sqlite3.connect('personal_diary.db')
-    c = conn.cursor()
-    
-    c.execute("SELECT * FROM entries ORDER BY date DESC")
-    entries = c.fetchall()
+    import pandas as pd
     
-    conn.close()
+    entries = db.get_all_entries()
     
     # 转换为DataFrame
-    columns = ["id", "日期", "标题", "内容", "心情", "标签"]
-    df = pd.DataFrame(entries, columns=columns)
+    df = pd.DataFrame(entries, columns=ENTRY_COLUMNS)
+    return df
+
+# 按筛选条件分页获取日记
+def list_entries(start_date, end_date, moods, tags, match_all=False, after=None, limit=20):
+    import pandas as pd
+    
+    entries = db.list_entries(start_date, end_date, moods, tags, match_all, after=after, limit=limit)
+    
+    df = pd.DataFrame(entries, columns=ENTRY_COLUMNS)
     return df
 
 # 按日期获取日记
 def get_entry_by_date(date):
-    conn = sqlite3.connect('personal_diary.db')
-    c = conn.cursor()
+    return db.get_entry_by_date(date)
+
+# 搜索日记（全文索引，按相关度排序）
+def search_entries(query, limit=50):
+    import pandas as pd
     
-    c.execute("SELECT * FROM entries WHERE date = ?", (date,))
-    entry = c.fetchone()
+    results = db.search_entries(query, limit=limit)
     
-    conn.close()
-    return entry
+    columns = ["id", "日期", "标题", "内容", "心情", "标签", "摘要", "修改时间"]
+    df = pd.DataFrame(results, columns=columns)
+    return df
 
-# 更新日记
-def update_entry(entry_id, title, content, mood, tags):
-    conn = sqlite3.connect('personal_diary.db')
-    c = conn.cursor()
-    
+# 更新日记，draft_key 不为 None 时同时删除对应的草稿
+def update_entry(entry_id, title, content, mood, tags, draft_key=None):
     try:
-        c.execute("UPDATE entries SET title = ?, content = ?, mood = ?, tags = ? WHERE id = ?", 
-                  (title, content, mood, tags, entry_id))
-        conn.commit()
+        db.update_entry(entry_id, title, content, mood, tags, draft_key)
         return True
     except Exception as e:
         st.error(f"更新日记失败: {e}")
         return False
-    finally:
-        conn.close()
 
 # 删除日记
 def delete_entry(entry_id):
-    conn = sqlite3.connect('personal_diary.db')
-    c = conn.cursor()
-    
     try:
-        c.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
-        conn.commit()
+        db.delete_entry(entry_id)
         return True
     except Exception as e:
         st.error(f"删除日记失败: {e}")
         return False
-    finally:
-        conn.close()
 
-# 生成日历视图
+# 相关日记：与这篇日记最相似的几篇（本地的字符 n-gram TF-IDF 向量）
+def render_related(entry_id):
+    import related
+    
+    similar = related.related_entries(entry_id)
+    if not similar:
+        return
+    scores = dict(similar)
+    lines = []
+    for row in db.get_entries([related_id for related_id, _ in similar]):
+        preview = row[3][:80].replace("\n", " ")
+        lines.append(f"- **{row[1]} {row[2]}** · 相似度 {scores[row[0]]:.2f}<br><span style='color:#7f8c8d;'>{preview}</span>")
+    with st.expander("相关日记", expanded=True):
+        st.markdown("\n".join(lines), unsafe_allow_html=True)
+
+# 浏览器端自动保存草稿：表单中的内容在提交前不会发送到服务器，所以由页面中的脚本监听输入，
+# 停止输入 1 秒后把标题、正文和标签发送到 /drafts（由 server.py 提供），关闭页面时立即发送
+# 请求带上编辑器的令牌，服务器据此确定数据库文件和草稿；日期和心情取最近一次提交时的值
+# 监听只安装一次，之后每个编辑器只登记自己的令牌
+DRAFT_SCRIPT = """
+<script>
+    if (!window.diaryDrafts) {
+        window.diaryDrafts = {editors: {}, timers: {}};
+        const FIELDS = ['title', 'tags', 'content'];
+        const send = function(prefix, leaving) {
+            clearTimeout(diaryDrafts.timers[prefix]);
+            delete diaryDrafts.timers[prefix];
+            const data = {token: diaryDrafts.editors[prefix]};
+            for (const name of FIELDS) {
+                const field = document.querySelector('.st-key-' + prefix + '_' + name + ' :is(input, textarea)');
+                if (!field) {
+                    return;
+                }
+                data[name] = field.value;
+            }
+            const body = JSON.stringify(data);
+            // 页面关闭时的请求最多 64 KB
+            if (leaving && body.length < 60000 && navigator.sendBeacon('/drafts', body)) {
+                return;
+            }
+            fetch('/drafts', {method: 'POST', body: body, keepalive: body.length < 60000}).catch(function() {});
+        };
+        document.addEventListener('input', function(event) {
+            const element = event.target.closest && event.target.closest('[class*="st-key-"]');
+            const match = element && / st-key-(\S+)_(title|tags|content)(?= |$)/.exec(' ' + element.className);
+            if (!match || !(match[1] in diaryDrafts.editors)) {
+                return;
+            }
+            const prefix = match[1];
+            clearTimeout(diaryDrafts.timers[prefix]);
+            diaryDrafts.timers[prefix] = setTimeout(function() { send(prefix, false); }, 1000);
+        }, true);
+        const flush = function() {
+            for (const prefix of Object.keys(diaryDrafts.timers)) {
+                send(prefix, true);
+            }
+        };
+        window.addEventListener('pagehide', flush);
+        document.addEventListener('visibilitychange', function() {
+            if (document.visibilityState === 'hidden') {
+                flush();
+            }
+        });
+    }
+    window.diaryDrafts.editors[%s] = %s;
+</script>
+"""
+
+# 第一次显示编辑控件时填入初始内容：有比日记更新的草稿时用草稿，返回草稿的保存时间
+def init_editor(prefix, draft_key, date, title, mood, tags, content, updated_at=0):
+    if f"{prefix}_content" in st.session_state:
+        return st.session_state.get(f"{prefix}_restored")
+    draft = db.get_draft(draft_key)
+    restored = None
+    if draft and draft[6] > updated_at:
+        _, date, title, content, mood, tags, restored = draft
+    values = [datetime.date.fromisoformat(date), title, mood, tags, content]
+    for name, value in zip(EDITOR_FIELDS, values):
+        st.session_state[f"{prefix}_{name}"] = value
+    st.session_state[f"{prefix}_restored"] = restored
+    return restored
+
+# 清除编辑控件的状态，下次显示时重新填入
+def reset_editor(prefix):
+    for name in EDITOR_FIELDS + ["restored", "token"]:
+        st.session_state.pop(f"{prefix}_{name}", None)
+
+# 日记编辑控件（在表单中调用，提交时才发送到服务器；输入的内容由浏览器端脚本自动保存为草稿）
+def editor_widgets(db_path, draft_key, prefix, entry_id=None):
+    state = st.session_state
+    mood = state[f"{prefix}_mood"]
+    moods = MOODS if mood in MOODS else MOODS + [mood]
+    st.date_input("日期", key=f"{prefix}_date")
+    st.text_input("标题", key=f"{prefix}_title", placeholder="今天的美好时刻")
+    st.selectbox("心情", moods, key=f"{prefix}_mood")
+    st.text_input("标签 (用逗号分隔)", key=f"{prefix}_tags", placeholder="例如: 旅行, 生日, 感悟")
+    st.text_area("日记内容", key=f"{prefix}_content", height=300,
+                 placeholder="写下今天的经历和感受...", help="尽情表达你的想法和情感")
+    
+    token = drafts.register(db_path, draft_key, entry_id, state[f"{prefix}_date"].isoformat(), mood,
+                            state.get(f"{prefix}_token"))
+    state[f"{prefix}_token"] = token
+    st.html(DRAFT_SCRIPT % (json.dumps(prefix), json.dumps(token)), unsafe_allow_javascript=True)
+    return [state[f"{prefix}_{name}"] for name in EDITOR_FIELDS]
+
+# 显示时间戳，0 表示时间未知（迁移 5 之前的日记没有记录修改时间，不显示成 1970 年）
+def format_time(timestamp):
+    if not timestamp:
+        return "时间未知"
+    return f"{datetime.datetime.fromtimestamp(timestamp):%Y-%m-%d %H:%M:%S}"
+
+# 显示恢复草稿的提示，点击“丢弃草稿”时删除草稿并恢复初始内容
+def draft_notice(db_path, draft_key, prefix, restored):
+    if not restored:
+        return
+    col_info, col_btn = st.columns([5, 1])
+    with col_info:
+        st.info(f"已恢复 {format_time(restored)} 自动保存的草稿")
+    with col_btn:
+        if st.button("丢弃草稿", key=f"{prefix}_discard"):
+            drafts.discard(db_path, draft_key)
+            db.delete_draft(draft_key)
+            reset_editor(prefix)
+            st.rerun()
+
+# 写新日记（作为片段运行，提交时只重跑这一部分）
+@st.fragment
+def add_entry_editor(db_path, default_date):
+    db.select_database(db_path)
+    restored = init_editor("add", "new", default_date, "", MOODS[0], "", "")
+    
+    # 从日历跳转过来时使用所选的日期
+    if st.session_state.get("add_default_date") != default_date:
+        if "add_default_date" in st.session_state:
+            st.session_state.add_date = datetime.date.fromisoformat(default_date)
+        st.session_state.add_default_date = default_date
+    
+    draft_notice(db_path, "new", "add", restored)
+    with st.form("add_entry_form"):
+        date, title, mood, tags, content = editor_widgets(db_path, "new", "add")
+        submitted = st.form_submit_button("保存日记", type="primary")
+    st.caption("输入的内容会自动保存为草稿，关闭页面后再打开也不会丢失（需要用 streamlit run server.py 启动）")
+    
+    if submitted:
+        if not content:
+            st.warning("请填写日记内容！")
+        else:
+            # 草稿在同一个事务中删除
+            drafts.discard(db_path, "new")
+            if add_entry(date.isoformat(), title, content, mood, tags, draft_key="new"):
+                st.success("日记保存成功！")
+                # 清除输入内容
+                reset_editor("add")
+                st.rerun()
+
+# 编辑日记（作为片段运行，提交时只重跑这一部分）
+@st.fragment
+def edit_entry_editor(db_path, entry):
+    db.select_database(db_path)
+    entry_id = entry[0]
+    prefix, draft_key = f"edit{entry_id}", f"entry:{entry_id}"
+    restored = init_editor(prefix, draft_key, entry[1], entry[2], entry[4], entry[5], entry[3], entry[6])
+    
+    draft_notice(db_path, draft_key, prefix, restored)
+    with st.form(f"{prefix}_form"):
+        date, title, mood, tags, content = editor_widgets(db_path, draft_key, prefix, entry_id)
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            save_btn = st.form_submit_button("保存修改", type="primary")
+        with col2:
+            cancel_btn = st.form_submit_button("取消编辑")
+    
+    if save_btn:
+        drafts.discard(db_path, draft_key)
+        if update_entry(entry_id, title, content, mood, tags, draft_key=draft_key):
+            st.success("日记更新成功！")
+            reset_editor(prefix)
+            del st.session_state.edit_entry
+            st.rerun()
+    
+    if cancel_btn:
+        drafts.discard(db_path, draft_key)
+        db.delete_draft(draft_key)
+        reset_editor(prefix)
+        del st.session_state.edit_entry
+        st.rerun()
+    
+    # 历史版本：查看与当前版本的差异，恢复时当前内容也会保存为一个版本
+    history = db.list_revisions(entry_id)
+    if history:
+        with st.expander(f"历史版本（{len(history)}）"):
+            saved = {rev: created_at for rev, _, _, created_at in history}
+            rev = st.selectbox("选择版本", list(saved), key=f"{prefix}_rev",
+                               format_func=lambda rev: f"版本 {rev} · {format_time(saved[rev])}")
+            version = db.get_revision(entry_id, rev)
+            if version:
+                old_title, old_content, old_mood, old_tags = version
+                st.markdown(render_card(db_path, entry_id, saved[rev], f"rev:{rev}", entry[1], old_title, old_content, old_mood, old_tags),
+                            unsafe_allow_html=True)
+                changes = "\n".join(difflib.unified_diff(old_content.splitlines(), entry[3].splitlines(),
+                                                         f"版本 {rev}", "当前版本", lineterm=""))
+                if changes:
+                    st.caption("与当前版本的差异")
+                    st.code(changes, language="diff")
+                if st.button("恢复此版本", key=f"{prefix}_restore"):
+                    drafts.discard(db_path, draft_key)
+                    if restore_revision(entry_id, rev):
+                        reset_editor(prefix)
+                        st.rerun()
+
+# 恢复日记的历史版本
+def restore_revision(entry_id, rev):
+    try:
+        db.restore_revision(entry_id, rev)
+        return True
+    except Exception as e:
+        st.error(f"恢复版本失败: {e}")
+        return False
+
+# 生成日历视图（按年月和数据版本缓存生成的 HTML）
+@db.cached_query
 def generate_calendar(year, month):
     cal = calendar.monthcalendar(year, month)
     month_name = calendar.month_name[month]
     
-    # 获取该月所有日记日期
+    # 获取该月每天的日记汇总
     start_date = f"{year}-{month:02d}-01"
     end_date = f"{year}-{month:02d}-{calendar.monthrange(year, month)[1]}"
     
-    conn = sqlite3.connect('personal_diary.db')
-    c = conn.cursor()
-    c.execute("SELECT date FROM entries WHERE date BETWEEN ? AND ?", (start_date, end_date))
-    diary_dates = [row[0] for row in c.fetchall()]
-    conn.close()
+    summary = db.get_daily_summary(start_date, end_date)
     
     # 创建日历HTML
-    html = f"<div style='text-align: center; margin-bottom: 20px;'><h3>{month_name} {year}</h3></div>"
-    html += "<table style='width:100%; border-collapse: collapse;'>"
-    html += "<tr><th style='border:1px solid #ddd; padding:8px;'>周一</th><th style='border:1px solid #ddd; padding:8px;'>周二</th><th style='border:1px solid #ddd; padding:8px;'>周三</th><th style='border:1px solid #ddd; padding:8px;'>周四</th><th style='border:1px solid #ddd; padding:8px;'>周五</th><th style='border:1px solid #ddd; padding:8px;'>周六</th><th style='border:1px solid #ddd; padding:8px;'>周日</th></tr>"
+    parts = [f"<div style='text-align: center; margin-bottom: 20px;'><h3>{month_name} {year}</h3></div>"]
+    parts.append("<table style='width:100%; border-collapse: collapse;'>")
+    parts.append("<tr>" + "".join(f"<th style='border:1px solid #ddd; padding:8px;'>{name}</th>" for name in WEEKDAY_NAMES) + "</tr>")
     
     for week in cal:
-        html += "<tr>"
+        parts.append("<tr>")
         for day in week:
             if day == 0:
-                html += "<td style='border:1px solid #ddd; padding:8px; background-color:#f9f9f9;'></td>"
+                parts.append("<td style='border:1px solid #ddd; padding:8px; background-color:#f9f9f9;'></td>")
             else:
                 date_str = f"{year}-{month:02d}-{day:02d}"
-                if date_str in diary_dates:
-                    html += f"<td style='border:1px solid #ddd; padding:8px; background-color:#e6f7ff; text-align:center;'><a href='?date={date_str}' style='color:#1890ff; text-decoration:none;'>{day}</a></td>"
+                if date_str in summary:
+                    count, mood = summary[date_str]
+                    # 显示心情的第一个词（表情）；心情为空时（其他程序写入的数据）显示默认图标
+                    words = (mood or "").split()
+                    badge = (words[0] if words else "📝") + (f" ×{count}" if count > 1 else "")
+                    parts.append(f"<td style='border:1px solid #ddd; padding:8px; background-color:#e6f7ff; text-align:center;'><a href='?date={date_str}' style='color:#1890ff; text-decoration:none;'>{day}<br><small>{badge}</small></a></td>")
                 else:
-                    html += f"<td style='border:1px solid #ddd; padding:8px; text-align:center;'><a href='?date={date_str}' style='color:#333; text-decoration:none;'>{day}</a></td>"
-        html += "</tr>"
-    
-    html += "</table>"
-    return html
-# 在 main() 开头添加
-st.markdown("""
-    <link rel="manifest" href="/manifest.json">
-    <script>
+                    parts.append(f"<td style='border:1px solid #ddd; padding:8px; text-align:center;'><a href='?date={date_str}' style='color:#333; text-decoration:none;'>{day}</a></td>")
+        parts.append("</tr>")
+    
+    parts.append("</table>")
+    return "".join(parts)
+
+# 生成全年热力图（一次查询整年的汇总，按年份和数据版本缓存）
+@db.cached_query
+def generate_year_heatmap(year):
+    summary = db.get_daily_summary(f"{year}-01-01", f"{year}-12-31")
+    
+    # 从1月1日所在周的周一开始，每列是一周
+    first_day = datetime.date(year, 1, 1)
+    last_day = datetime.date(year, 12, 31)
+    start = first_day - datetime.timedelta(days=first_day.weekday())
+    weeks = (last_day - start).days // 7 + 1
+    
+    parts = [f"<div style='text-align: center; margin-bottom: 20px;'><h3>{year} 年 · {sum(c for c, _ in summary.values())} 篇日记</h3></div>"]
+    parts.append("<div style='overflow-x: auto;'><table style='border-collapse: separate; border-spacing: 3px; margin: 0 auto;'>")
+    
+    # 月份标题：放在包含该月1日的那一周上
+    parts.append("<tr><td></td>")
+    for week in range(weeks):
+        week_start = start + datetime.timedelta(weeks=week)
+        week_end = week_start + datetime.timedelta(days=6)
+        label = ""
+        if week_end.year == year and (week_end.day <= 7):
+            label = f"{week_end.month}月"
+        parts.append(f"<td style='font-size:11px; color:#7f8c8d; padding:0;'>{label}</td>")
+    parts.append("</tr>")
+    
+    for weekday in range(7):
+        parts.append(f"<tr><td style='font-size:11px; color:#7f8c8d; padding:0 4px 0 0;'>{WEEKDAY_NAMES[weekday]}</td>")
+        for week in range(weeks):
+            day = start + datetime.timedelta(weeks=week, days=weekday)
+            if day.year != year:
+                parts.append("<td style='width:12px; height:12px; padding:0;'></td>")
+                continue
+            date_str = day.isoformat()
+            count, mood = summary.get(date_str, (0, None))
+            color = HEATMAP_COLORS[min(count, len(HEATMAP_COLORS) - 1)]
+            tip = f"{date_str}：{count} 篇" + (f"，{mood}" if mood else "")
+            parts.append(f"<td title='{tip}' style='width:12px; height:12px; padding:0; border-radius:2px; background-color:{color};'>"
+                         f"<a href='?date={date_str}' style='display:block; width:12px; height:12px;'></a></td>")
+        parts.append("</tr>")
+    
+    parts.append("</table></div>")
+    return "".join(parts)
+
+# 根据写过日记的日期（升序）计算当前连续天数和最长连续天数
+def compute_streaks(days, today):
+    import numpy as np
+    
+    if not days:
+        return 0, 0
+    ordinals = np.array(days, dtype="datetime64[D]").astype(np.int64)
+    
+    # 相邻日期不连续的位置把日期分成若干段，每段就是一次连续记录
+    breaks = np.flatnonzero(np.diff(ordinals) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    lengths = np.diff(np.concatenate((starts, [len(ordinals)])))
+    
+    # 最后一次记录是今天或昨天时，最后一段仍在继续
+    gap = np.datetime64(today, "D").astype(np.int64) - ordinals[-1]
+    current = int(lengths[-1]) if gap <= 1 else 0
+    return current, int(lengths.max())
+
+# 侧边栏性能面板：本次重跑的每个数据库调用和页面区块，以及本会话内各操作的 p50/p95
+def render_perf_panel():
+    run, total_ms = perf.finish_run()
+    history = st.session_state.setdefault("perf_history", {})
+    perf.update_history(history, run + [{"kind": "rerun", "name": "总计", "ms": total_ms}])
+    perf.write_log(run, total_ms, page=st.session_state.get("perf_page"))
+    
+    with st.sidebar.expander(f"性能面板 · 本次重跑 {total_ms:.1f} ms", expanded=True):
+        db_ms = sum(item["ms"] for item in run if item["kind"] == "db")
+        st.caption(f"数据库调用 {sum(item['kind'] == 'db' for item in run)} 次，共 {db_ms:.1f} ms；"
+                   f"查询缓存命中 {db.cache_info()['hits']} 次")
+        st.dataframe([{"类型": item["kind"], "名称": item["name"], "毫秒": item["ms"], "行数": item["rows"],
+                       "SQL": " | ".join(" ".join(sql.split())[:120] for sql in item["sql"])} for item in run],
+                     hide_index=True, width="stretch")
+        st.caption("本会话各操作耗时（毫秒）")
+        st.dataframe(perf.percentiles(history), hide_index=True, width="stretch")
+
+# 写日记页面
+def write_page(selected_date):
+    st.subheader("写新日记")
+    
+    # 默认使用URL参数中的日期或今天
+    default_date = selected_date or datetime.date.today().isoformat()
+    
+    add_entry_editor(db.current_path(), default_date)
+
+# 看日记页面
+def list_page(selected_date):
+    st.subheader("我的日记")
+    
+    # 只查询日期范围和总数，不加载全部日记
+    min_date, max_date, total = db.get_date_bounds()
+    
+    if total == 0:
+        st.info("还没有日记，开始写下你的第一篇日记吧！")
+    else:
+        # 日期筛选
+        col1, col2 = st.columns(2)
+        with col1:
+            start_date = st.date_input("开始日期", value=datetime.date.fromisoformat(min_date))
+        with col2:
+            end_date = st.date_input("结束日期", value=datetime.date.fromisoformat(max_date))
+        
+        # 心情筛选：内置的心情加上已保存的其他心情（导入或 API 写入的日记可以是任意心情）
+        moods = MOODS + [mood for mood in db.get_moods() if mood not in MOODS]
+        selected_moods = st.multiselect("心情筛选", options=moods, default=moods)
+        
+        # 标签筛选（标签和计数来自标签表，不扫描日记）
+        tag_counts = db.get_tag_counts()
+        tag_col1, tag_col2 = st.columns([4, 1])
+        with tag_col1:
+            selected_tags = st.multiselect("标签筛选", options=[name for name, _ in tag_counts],
+                                           format_func=lambda name: f"{name} ({dict(tag_counts)[name]})")
+        with tag_col2:
+            tag_mode = st.radio("标签匹配", ["任意", "全部"], horizontal=True)
+        match_all = tag_mode == "全部"
+        
+        # 标签云
+        if tag_counts:
+            with st.expander("标签云"):
+                max_count = max(count for _, count in tag_counts)
+                cloud_html = "<div style='line-height: 2.2;'>"
+                for name, count in tag_counts:
+                    font_size = 12 + 16 * count // max_count
+                    cloud_html += f"<span class='tag' style='font-size:{font_size}px;'>{name} ({count})</span>"
+                cloud_html += "</div>"
+                st.markdown(cloud_html, unsafe_allow_html=True)
+        
+        # 每页显示数量
+        page_size = st.selectbox("每页显示", [10, 20, 50, 100], index=1)
+        
+        # 筛选条件变化时回到第一页
+        filter_key = (start_date.isoformat(), end_date.isoformat(), tuple(selected_moods), tuple(selected_tags), match_all, page_size)
+        if st.session_state.get("list_filter") != filter_key:
+            st.session_state.list_filter = filter_key
+            st.session_state.list_cursors = []
+        cursors = st.session_state.list_cursors
+        after = cursors[-1] if cursors else None
+        
+        # 在数据库中筛选，只取当前页（多取一条用于判断是否还有下一页）
+        filtered_total = db.count_entries(start_date.isoformat(), end_date.isoformat(), selected_moods, selected_tags, match_all)
+        filtered_entries = list_entries(start_date.isoformat(), end_date.isoformat(), selected_moods, selected_tags,
+                                        match_all, after=after, limit=page_size + 1)
+        has_next = len(filtered_entries) > page_size
+        filtered_entries = filtered_entries.head(page_size)
+        
+        # 显示日记
+        if filtered_entries.empty:
+            st.info("没有找到符合条件的日记")
+        else:
+            st.write(f"找到 {filtered_total} 篇日记（第 {len(cursors) + 1} 页）")
+            
+            # 每篇日记卡片（缓存的 HTML，长日记只显示开头）下面是它自己的操作按钮
+            page_titles = dict(zip(filtered_entries["id"].tolist(), filtered_entries["日期"] + " " + filtered_entries["标题"]))
+            for _, row in filtered_entries.iterrows():
+                entry_id = int(row["id"])
+                st.markdown(render_card(db.current_path(), entry_id, row["修改时间"], "preview",
+                                        row["日期"], row["标题"], row["内容"], row["心情"], row["标签"]),
+                            unsafe_allow_html=True)
+                col_btn1, col_btn2, col_btn3, _ = st.columns([1, 1, 1, 7])
+                with col_btn1:
+                    if st.button("查看全文", key=f"view_{entry_id}"):
+                        st.session_state.view_entry = entry_id
+                with col_btn2:
+                    if st.button("编辑", key=f"edit_{entry_id}"):
+                        st.session_state.edit_entry = entry_id
+                with col_btn3:
+                    if st.button("删除", key=f"delete_{entry_id}"):
+                        st.session_state.confirm_delete = entry_id
+                
+                # 删除前确认，提示中写明是哪一篇
+                if st.session_state.get("confirm_delete") == entry_id:
+                    st.warning(f"确定要删除「{page_titles[entry_id]}」吗？删除后无法恢复。")
+                    col_yes, col_no, _ = st.columns([1, 1, 8])
+                    with col_yes:
+                        if st.button("确认删除", key=f"confirm_delete_{entry_id}", type="primary"):
+                            del st.session_state.confirm_delete
+                            if delete_entry(entry_id):
+                                st.success("日记已删除！")
+                                st.rerun()
+                    with col_no:
+                        if st.button("取消", key=f"cancel_delete_{entry_id}"):
+                            del st.session_state.confirm_delete
+                            st.rerun()
+            
+            # 完整日记（只在这里解压正文）
+            if st.session_state.get("view_entry") in page_titles:
+                entry = db.get_entry(st.session_state.view_entry)
+                if entry:
+                    st.markdown(render_card(db.current_path(), entry[0], entry[6], "full", entry[1], entry[2], entry[3], entry[4], entry[5]),
+                                unsafe_allow_html=True)
+                    render_related(entry[0])
+            
+            # 翻页
+            col_prev, col_next = st.columns(2)
+            with col_prev:
+                if st.button("上一页", disabled=not cursors):
+                    cursors.pop()
+                    st.rerun()
+            with col_next:
+                if st.button("下一页", disabled=not has_next):
+                    last = filtered_entries.iloc[-1]
+                    cursors.append((last["日期"], int(last["id"])))
+                    st.rerun()
+
+# 日历视图
+def calendar_page(selected_date):
+    st.subheader("日历视图")
+    st.info("点击有日记的日期可以查看或编辑那天的日记")
+    
+    # 选择年月
+    today = datetime.date.today()
+    view_mode = st.radio("视图", ["月视图", "全年热力图"], horizontal=True)
+    col1, col2 = st.columns(2)
+    with col1:
+        year = st.number_input("选择年份", min_value=2000, max_value=2100, value=today.year)
+    if view_mode == "月视图":
+        with col2:
+            month = st.selectbox("选择月份", range(1, 13), index=today.month-1)
+        
+        # 生成日历
+        cal_html = generate_calendar(year, month)
+    else:
+        cal_html = generate_year_heatmap(year)
+    st.markdown(f"<div class='calendar-container'>{cal_html}</div>", unsafe_allow_html=True)
+    
+    # 显示选定日期的日记
+    if selected_date:
+        entry = get_entry_by_date(selected_date)
+        if entry:
+            st.subheader(f"{selected_date} 的日记")
+            st.markdown(render_card(db.current_path(), entry[0], entry[6], "full", entry[1], entry[2], entry[3], entry[4], entry[5]),
+                        unsafe_allow_html=True)
+            render_related(entry[0])
+            
+            # 编辑按钮
+            if st.button("编辑这篇日记"):
+                st.session_state.edit_entry = entry[0]
+        else:
+            st.info(f"{selected_date} 还没有日记")
+            if st.button(f"为 {selected_date} 写日记"):
+                # 使用新的 query_params 设置日期
+                st.query_params["date"] = selected_date
+                st.rerun()
+
+# 搜索日记
+def search_page(selected_date):
+    st.subheader("搜索日记")
+    
+    search_query = st.text_input("搜索内容", placeholder="输入关键词搜索日记...")
+    limit = st.number_input("最多显示", min_value=10, max_value=500, value=50, step=10)
+    
+    if search_query:
+        # 通过全文索引搜索，按相关度排序
+        results = search_entries(search_query, limit=limit)
+        
+        if results.empty:
+            st.info("没有找到匹配的日记")
+        else:
+            st.write(f"找到 {len(results)} 篇匹配的日记")
+            
+            # 匹配结果卡片（标题高亮，内容显示匹配片段）作为一个元素输出
+            render_cards(results, variant=search_query)
+            
+            # 操作：查看或编辑一篇结果
+            result_titles = dict(zip(results["id"].tolist(), results["日期"] + " " + results["标题"].str.replace("<mark>", "").str.replace("</mark>", "")))
+            col_sel, col_btn1, col_btn2 = st.columns([6, 1, 1])
+            with col_sel:
+                action_id = st.selectbox("选择日记", list(result_titles), format_func=result_titles.get,
+                                         label_visibility="collapsed")
+            with col_btn1:
+                if st.button("查看全文"):
+                    st.session_state.view_entry = action_id
+            with col_btn2:
+                if st.button("编辑"):
+                    st.session_state.edit_entry = action_id
+            
+            # 完整日记
+            if st.session_state.get("view_entry") in result_titles:
+                entry = db.get_entry(st.session_state.view_entry)
+                if entry:
+                    st.markdown(render_card(db.current_path(), entry[0], entry[6], "full", entry[1], entry[2], entry[3], entry[4], entry[5]),
+                                unsafe_allow_html=True)
+                    render_related(entry[0])
+
+# 统计
+def stats_page(selected_date):
+    import pandas as pd
+    
+    st.subheader("日记统计")
+    
+    # 所有数据来自汇总表，不读取日记内容
+    _, _, total = db.get_date_bounds()
+    if total == 0:
+        st.info("还没有日记，开始写下你的第一篇日记吧！")
+    else:
+        written_days = db.get_written_days()
+        current_streak, longest_streak = compute_streaks(written_days, datetime.date.today())
+        
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("日记总数", total)
+        col2.metric("写日记的天数", len(written_days))
+        col3.metric("当前连续天数", current_streak)
+        col4.metric("最长连续天数", longest_streak)
+        
+        # 每月各心情的日记数
+        mood_monthly = pd.DataFrame(db.get_mood_monthly(), columns=["月份", "心情", "日记数"])
+        mood_table = mood_monthly.pivot_table(index="月份", columns="心情", values="日记数", aggfunc="sum", fill_value=0)
+        
+        st.markdown("#### 每月日记数")
+        st.bar_chart(mood_table.sum(axis=1).rename("日记数"))
+        
+        st.markdown("#### 心情变化")
+        st.bar_chart(mood_table)
+        
+        col_left, col_right = st.columns(2)
+        with col_left:
+            st.markdown("#### 心情分布")
+            st.bar_chart(mood_table.sum(axis=0).sort_values(ascending=False).rename("日记数"), horizontal=True)
+        with col_right:
+            st.markdown("#### 常用标签")
+            top_tags = pd.DataFrame(db.get_top_tags(10), columns=["标签", "日记数"])
+            if top_tags.empty:
+                st.caption("还没有标签")
+            else:
+                st.bar_chart(top_tags.set_index("标签")["日记数"], horizontal=True)
+        
+        # 最近一年每周的日记数（没有日记的周补 0）
+        st.markdown("#### 最近 52 周")
+        weekly = pd.DataFrame(db.get_weekly_counts(), columns=["周", "日记数"])
+        weekly["周"] = pd.to_datetime(weekly["周"])
+        this_week = pd.Timestamp(datetime.date.today()).to_period("W-SUN").start_time
+        weeks = pd.date_range(end=this_week, periods=52, freq="7D")
+        st.line_chart(weekly.set_index("周")["日记数"].reindex(weeks, fill_value=0))
+
+# 导入导出
+def import_export_page(selected_date):
+    st.subheader("导入日记")
+    st.caption("支持 JSONL、CSV（列名：date/title/content/mood/tags 或 日期/标题/内容/心情/标签）和 Markdown 文件。"
+               "同一文件中断后再次导入会从上次的位置继续。大量数据也可以使用命令行：python bulk.py import <文件或文件夹>")
+    
+    uploads = st.file_uploader("选择文件", type=["jsonl", "json", "csv", "md", "markdown"], accept_multiple_files=True)
+    if uploads and st.button("开始导入"):
+        progress_bar = st.progress(0.0)
+        status = st.empty()
+        markdown_files = [f for f in uploads if f.name.lower().endswith((".md", ".markdown"))]
+        data_files = [f for f in uploads if f not in markdown_files]
+        
+        # 每个数据文件单独导入，所有 Markdown 文件作为一个来源
+        sources = []
+        for f in data_files:
+            text = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+            fmt = bulk.guess_format(f.name)
+            records = bulk.read_csv(text) if fmt == "csv" else bulk.read_jsonl(text)
+            sources.append((f.name, records, f"upload:{f.name}:{f.size}", None))
+        if markdown_files:
+            markdown_files.sort(key=lambda f: f.name)
+            records = (bulk.parse_markdown(f.name, f.getvalue().decode("utf-8")) for f in markdown_files)
+            # 续传标识包含文件名和内容摘要，大小相同的另一组文件不会被误认为同一来源
+            digest = hashlib.sha1()
+            for f in markdown_files:
+                digest.update(f.name.encode("utf-8") + b"\0" + f.getvalue() + b"\0")
+            key = "upload-md:" + digest.hexdigest() + ":" + str(len(markdown_files))
+            sources.append(("Markdown", records, key, len(markdown_files)))
+        
+        for name, records, source, total in sources:
+            def report(done, imported, skipped):
+                if total:
+                    progress_bar.progress(min(done / total, 1.0))
+                status.write(f"{name}：已处理 {done} 条，导入 {imported} 条，跳过 {skipped} 条")
+            try:
+                imported, skipped = bulk.import_records(records, source, progress=report)
+                st.success(f"{name}：导入 {imported} 条，跳过 {skipped} 条")
+            except Exception as e:
+                st.error(f"{name} 导入失败: {e}（再次导入会从中断的位置继续）")
+        progress_bar.progress(1.0)
+    
+    st.markdown("---")
+    st.subheader("导出日记")
+    export_format = st.radio("导出格式", ["JSONL", "CSV"], horizontal=True)
+    if st.button("生成导出文件"):
+        # 逐批写入临时文件，不在内存中构建全部数据
+        # 先删除上一次生成的导出文件，临时目录中最多只保留一份
+        if "export_file" in st.session_state:
+            try:
+                os.remove(st.session_state.pop("export_file")[0])
+            except OSError:
+                pass
+        suffix = "." + export_format.lower()
+        with tempfile.NamedTemporaryFile("w", suffix=suffix, encoding="utf-8", newline="", delete=False) as f:
+            count = bulk.export_csv(f) if export_format == "CSV" else bulk.export_jsonl(f)
+        st.session_state.export_file = (f.name, count)
+    if "export_file" in st.session_state and os.path.exists(st.session_state.export_file[0]):
+        path, count = st.session_state.export_file
+        with open(path, "rb") as f:
+            st.download_button(f"下载（{count} 篇日记）", f, file_name="diary" + os.path.splitext(path)[1])
+
+# 关于页面
+def about_page(selected_date):
+    st.subheader("关于个人日记本")
+    
+    st.markdown("""
+        ## 📖 个人日记本软件
+        
+        **个人日记本**是一个专为个人设计的日记记录软件，帮助您：
+        
+        - ✍️ 记录日常生活和重要时刻
+        - 😊 标记心情状态和情感变化
+        - 🏷️ 使用标签整理日记内容
+        - 📅 通过日历视图浏览日记
+        - 🔍 快速搜索过去的日记
+        
+        ### 主要功能
+        
+        1. **写日记**：
+           - 记录每天的所思所想
+           - 标记心情状态
+           - 添加自定义标签
+        
+        2. **看日记**：
+           - 按时间顺序浏览所有日记
+           - 按日期范围、心情、标签筛选
+        
+        3. **日历视图**：
+           - 直观查看有日记的日期
+           - 点击日期查看或编辑日记
+        
+        4. **搜索日记**：
+           - 通过关键词搜索日记内容
+           - 快速找到特定主题的日记
+        
+        ### 隐私保护
+        
+        - 所有数据存储在本地数据库（personal_diary.db）
+        - 无需联网，完全私密
+        - 您的日记只属于您一个人
+        
+        ### 使用说明
+        
+        1. 首次使用会自动创建数据库
+        2. 在"写日记"页面开始记录
+        3. 使用"看日记"或"日历视图"回顾过去的日记
+        4. 使用"搜索日记"查找特定内容
+        
+        **您的所有日记都保存在本地计算机上，应用会在后台定期备份到 backups 文件夹，也可以在"导入导出"页面导出日记，以防数据丢失。**
+    """)
+    
+    # 备份和优化状态
+    st.markdown("### 备份和维护")
+    db_path = db.current_path()
+    state = maintenance.status(db_path)
+    backups = maintenance.list_backups(db_path)
+    backup = state.get("backup")
+    if backup:
+        when = datetime.datetime.fromtimestamp(backup["time"]).strftime("%Y-%m-%d %H:%M:%S")
+        if backup["error"]:
+            st.warning(f"最近一次备份失败（{when}）：{backup['error']}")
+        else:
+            st.caption(f"最近一次备份：{when}，用时 {backup['ms']:.0f} ms（{backup['steps']} 步），"
+                       f"{backup['size'] / 1024:.0f} KB → {backup['file']}")
+    elif backups:
+        when = datetime.datetime.fromtimestamp(os.path.getmtime(backups[-1])).strftime("%Y-%m-%d %H:%M:%S")
+        st.caption(f"最近一次备份：{when} → {backups[-1]}")
+    else:
+        st.caption("还没有备份")
+    st.caption(f"保留最近 {maintenance.BACKUP_KEEP} 份备份，当前 {len(backups)} 份；"
+               + (f"每 {maintenance.BACKUP_INTERVAL / 3600:g} 小时自动备份" if maintenance.BACKUP_INTERVAL else "自动备份已关闭"))
+    
+    optimize = state.get("maintenance")
+    if optimize:
+        when = datetime.datetime.fromtimestamp(optimize["time"]).strftime("%Y-%m-%d %H:%M:%S")
+        steps = "，".join(f"{name} {ms:.0f} ms" for name, ms in optimize["steps"].items())
+        if optimize["error"]:
+            st.warning(f"最近一次优化失败（{when}）：{optimize['error']}")
+        else:
+            st.caption(f"最近一次优化：{when}，用时 {optimize['ms']:.0f} ms（{steps}）")
+    else:
+        st.caption("本次启动后还没有优化过（空闲时自动进行）")
+    
+    col_backup, col_optimize, col_index = st.columns(3)
+    with col_backup:
+        if st.button("立即备份"):
+            with st.spinner("正在备份..."):
+                try:
+                    maintenance.backup_database(db_path)
+                except Exception as e:
+                    st.error(f"备份失败: {e}")
+                else:
+                    st.rerun()
+    with col_optimize:
+        if st.button("立即优化"):
+            with st.spinner("正在优化..."):
+                try:
+                    maintenance.optimize_database(db_path)
+                except Exception as e:
+                    st.error(f"优化失败: {e}")
+                else:
+                    st.rerun()
+    with col_index:
+        # 其他程序直接写入数据库文件后，搜索索引需要重建
+        if st.button("重建搜索索引"):
+            with st.spinner("正在重建搜索索引..."):
+                try:
+                    db.rebuild_search_index()
+                except Exception as e:
+                    st.error(f"重建失败: {e}")
+                else:
+                    st.success("搜索索引已重建")
+    
+    st.markdown("---")
+    st.info("个人日记本 v1.0 | 设计: 您的私人记忆守护者 | 2025年")
+    
+    # 查询缓存状态
+    info = db.cache_info()
+    st.caption(f"查询缓存：命中 {info['hits']} 次，未命中 {info['misses']} 次，淘汰 {info['evictions']} 次，"
+               f"当前 {info['size']}/{info['maxsize']} 条，数据版本 {info['version']}")
+
+# 导航菜单中的页面：只运行所选页面的函数
+PAGES = {
+    "写日记": write_page,
+    "看日记": list_page,
+    "日历视图": calendar_page,
+    "搜索日记": search_page,
+    "统计": stats_page,
+    "导入导出": import_export_page,
+    "关于": about_page,
+}
+
+# 页面样式
+STYLE = """
+    .main {background-color: #f8f9fa;}
+    .stApp {background-color: #f8f9fa;}
+    .header {color: #2c3e50; text-align: center; padding: 10px;}
+    .diary-entry { 
+        background-color: white;
+        border-radius: 10px;
+        padding: 20px;
+        margin: 15px 0;
+        box-shadow: 0 4px 6px rgba(0,0,0,0.05);
+    }
+    .diary-title {
+        font-size: 24px;
+        font-weight: bold;
+        color: #2c3e50;
+        margin-bottom: 10px;
+    }
+    .diary-date {
+        color: #7f8c8d;
+        font-size: 14px;
+        margin-bottom: 15px;
+    }
+    .diary-content {
+        color: #34495e;
+        line-height: 1.8;
+        font-size: 16px;
+        white-space: pre-line;
+    }
+    .mood-tag {
+        display: inline-block;
+        padding: 4px 10px;
+        border-radius: 20px;
+        font-size: 13px;
+        margin-right: 8px;
+        margin-top: 10px;
+    }
+    .calendar-container {
+        background-color: white;
+        border-radius: 10px;
+        padding: 20px;
+        margin: 15px 0;
+        box-shadow: 0 4px 6px rgba(0,0,0,0.05);
+    }
+    .tag {
+        display: inline-block;
+        background-color: #e0f7fa;
+        color: #006064;
+        padding: 2px 8px;
+        border-radius: 4px;
+        font-size: 12px;
+        margin-right: 5px;
+        margin-top: 5px;
+    }
+"""
+
+# 样式和 PWA 清单放入页面的 <head>：重跑时页面元素会被替换，<head> 中的内容会保留，
+# 所以每个浏览器会话只需要输出一次（重新加载页面会开始新的会话）
+# 清单、图标和 service worker 由 server.py 提供（streamlit run server.py）
+HEAD_HTML = """
+<script>
+    if (!document.getElementById('diary-style')) {
+        const style = document.createElement('style');
+        style.id = 'diary-style';
+        style.textContent = %s;
+        document.head.appendChild(style);
+        
+        const manifest = document.createElement('link');
+        manifest.rel = 'manifest';
+        manifest.href = '/manifest.json';
+        document.head.appendChild(manifest);
+        
         if ('serviceWorker' in navigator) {
-            window.addEventListener('load', () => {
-                navigator.serviceWorker.register('/service-worker.js');
-            });
+            navigator.serviceWorker.register('/service-worker.js');
         }
-    </script>
-""", unsafe_allow_html=True)
+    }
+</script>
+""" % json.dumps(STYLE)
+
+# 输出页面样式和 PWA 清单（每个会话一次）
+def inject_head():
+    if st.session_state.get("head_injected"):
+        return
+    st.session_state.head_injected = True
+    st.html(HEAD_HTML, unsafe_allow_javascript=True)
+
 # 主应用
 def main():
+    # 性能记录：环境变量 DIARY_PROFILE=1 或网址参数 ?profile=1
+    profiling = perf.ENABLED or st.query_params.get("profile") == "1"
+    perf.start_run(profiling)
+    
     # 页面配置
     st.set_page_config(
         page_title="个人日记本",
@@ -149,66 +1019,25 @@ def main():
         layout="wide"
     )
     
-    # 自定义样式
-    st.markdown("""
-        <style>
-            .main {background-color: #f8f9fa;}
-            .stApp {background-color: #f8f9fa;}
-            .header {color: #2c3e50; text-align: center; padding: 10px;}
-            .diary-entry { 
-                background-color: white;
-                border-radius: 10px;
-                padding: 20px;
-                margin: 15px 0;
-                box-shadow: 0 4px 6px rgba(0,0,0,0.05);
-            }
-            .diary-title {
-                font-size: 24px;
-                font-weight: bold;
-                color: #2c3e50;
-                margin-bottom: 10px;
-            }
-            .diary-date {
-                color: #7f8c8d;
-                font-size: 14px;
-                margin-bottom: 15px;
-            }
-            .diary-content {
-                color: #34495e;
-                line-height: 1.8;
-                font-size: 16px;
-                white-space: pre-line;
-            }
-            .mood-tag {
-                display: inline-block;
-                padding: 4px 10px;
-                border-radius: 20px;
-                font-size: 13px;
-                margin-right: 8px;
-                margin-top: 10px;
-            }
-            .calendar-container {
-                background-color: white;
-                border-radius: 10px;
-                padding: 20px;
-                margin: 15px 0;
-                box-shadow: 0 4px 6px rgba(0,0,0,0.05);
-            }
-            .tag {
-                display: inline-block;
-                background-color: #e0f7fa;
-                color: #006064;
-                padding: 2px 8px;
-                border-radius: 4px;
-                font-size: 12px;
-                margin-right: 5px;
-                margin-top: 5px;
-            }
-        </style>
-    """, unsafe_allow_html=True)
+    # 多用户模式：每个用户使用自己的数据库文件（网址参数 ?user=用户名 或侧边栏输入）
+    # 用户名没有密码保护，任何人输入同一个用户名都能看到该用户的日记（见 db.SHARDS_DIR）
+    if db.SHARDS_DIR:
+        user = st.query_params.get("user") or st.sidebar.text_input("用户名", key="diary_user").strip()
+        st.sidebar.caption("⚠️ 用户名没有密码保护，请只在可信的网络中使用")
+        if not user:
+            st.info("请在侧边栏输入用户名")
+            st.stop()
+        db.use_shard(user)
+    else:
+        db.select_database(None)
     
-    # 初始化数据库
-    create_database()
+    with perf.section("样式和初始化"):
+        # 样式和 PWA 清单（每个浏览器会话只输出一次）
+        inject_head()
+        
+        # 初始化数据库（每个进程每个数据库文件只执行一次），并启动后台备份和优化
+        db.init_db()
+        maintenance.start()
     
     # 获取URL参数 - 正确使用 st.query_params
     # 注意：st.query_params 是一个属性，不是函数，不要加括号
@@ -219,323 +1048,32 @@ def main():
     if isinstance(selected_date, list) and selected_date:
         selected_date = selected_date[0]
     
-    # 当前日期
-    today = datetime.date.today().isoformat()
-    
     # 页面标题
     st.markdown('<div class="header"><h1>📔 个人日记本</h1></div>', unsafe_allow_html=True)
     st.caption("记录生活点滴，珍藏美好回忆")
     
     # 侧边栏导航
     st.sidebar.title("导航")
-    menu = st.sidebar.radio("选择功能", ["写日记", "看日记", "日历视图", "搜索日记", "关于"])
+    menu = st.sidebar.radio("选择功能", list(PAGES))
+    st.session_state.perf_page = menu
     
-    # 写日记页面
-    if menu == "写日记":
-        st.subheader("写新日记")
-        
-        # 默认使用URL参数中的日期或今天
-        default_date = selected_date if selected_date else today
-        
-        with st.form("add_entry_form", clear_on_submit=True):
-            date = st.date_input("日期", value=datetime.date.fromisoformat(default_date))
-            title = st.text_input("标题", placeholder="今天的美好时刻")
-            
-            mood = st.selectbox("心情", ["😊 开心", "😄 兴奋", "😌 平静", "😢 难过", "😠 生气", "😔 忧郁", "😴 疲惫", "🤔 思考"])
-            
-            tags = st.text_input("标签 (用逗号分隔)", placeholder="例如: 旅行, 生日, 感悟")
-            
-            content = st.text_area("日记内容", height=300, 
-                                  placeholder="写下今天的经历和感受...", 
-                                  help="尽情表达你的想法和情感")
-            
-            submitted = st.form_submit_button("保存日记")
-            
-            if submitted:
-                if not content:
-                    st.warning("请填写日记内容！")
-                else:
-                    date_str = date.isoformat()
-                    success = add_entry(date_str, title, content, mood, tags)
-                    if success:
-                        st.success("日记保存成功！")
-                        # 清除表单
-                        st.rerun()
+    # 只运行所选页面的代码
+    with perf.section(f"页面:{menu}"):
+        PAGES[menu](selected_date)
     
-    # 看日记页面
-    elif menu == "看日记":
-        st.subheader("我的日记")
-        
-        # 获取所有日记
-        entries_df = get_all_entries()
-        
-        if entries_df.empty:
-            st.info("还没有日记，开始写下你的第一篇日记吧！")
-        else:
-            # 日期筛选
-            col1, col2 = st.columns(2)
-            with col1:
-                start_date = st.date_input("开始日期", value=datetime.date.fromisoformat(entries_df["日期"].min()))
-            with col2:
-                end_date = st.date_input("结束日期", value=datetime.date.fromisoformat(entries_df["日期"].max()))
-            
-            # 心情筛选
-            moods = ["😊 开心", "😄 兴奋", "😌 平静", "😢 难过", "😠 生气", "😔 忧郁", "😴 疲惫", "🤔 思考"]
-            selected_moods = st.multiselect("心情筛选", options=moods, default=moods)
-            
-            # 标签筛选
-            all_tags = set()
-            for tags_str in entries_df["标签"]:
-                if tags_str:
-                    all_tags.update(tag.strip() for tag in tags_str.split(','))
-            selected_tags = st.multiselect("标签筛选", options=sorted(all_tags))
-            
-            # 应用筛选
-            filtered_entries = entries_df.copy()
-            filtered_entries = filtered_entries[
-                (filtered_entries["日期"] >= start_date.isoformat()) &
-                (filtered_entries["日期"] <= end_date.isoformat()) &
-                (filtered_entries["心情"].isin(selected_moods))
-            ]
-            
-            if selected_tags:
-                filtered_entries = filtered_entries[
-                    filtered_entries["标签"].apply(
-                        lambda x: any(tag in (x.split(',') if x else []) for tag in selected_tags)
-                    )
-                ]
+    # 编辑日记（特殊状态）
+    with perf.section("编辑日记"):
+        if 'edit_entry' in st.session_state:
+            entry_id = st.session_state.edit_entry
+            entry = db.get_entry(entry_id)
             
-            # 显示日记
-            if filtered_entries.empty:
-                st.info("没有找到符合条件的日记")
-            else:
-                st.write(f"找到 {len(filtered_entries)} 篇日记")
-                
-                for _, row in filtered_entries.iterrows():
-                    with st.container():
-                        st.markdown(f"<div class='diary-entry'>", unsafe_allow_html=True)
-                        
-                        # 日期和心情
-                        mood_bg_color = '#e3f2fd' if '开心' in row['心情'] or '兴奋' in row['心情'] else '#ffebee' if '难过' in row['心情'] or '生气' in row['心情'] else '#f3e5f5'
-                        st.markdown(f"<div class='diary-date'>{row['日期']} <span class='mood-tag' style='background-color:{mood_bg_color};'>{row['心情']}</span></div>", unsafe_allow_html=True)
-                        
-                        # 标题
-                        st.markdown(f"<div class='diary-title'>{row['标题']}</div>", unsafe_allow_html=True)
-                        
-                        # 标签
-                        if row['标签'] and isinstance(row['标签'], str):
-                            tags_html = "<div style='margin-bottom: 10px;'>"
-                            for tag in row['标签'].split(','):
-                                tags_html += f"<span class='tag'>{tag.strip()}</span>"
-                            tags_html += "</div>"
-                            st.markdown(tags_html, unsafe_allow_html=True)
-                        
-                        # 内容
-                        st.markdown(f"<div class='diary-content'>{row['内容']}</div>", unsafe_allow_html=True)
-                        
-                        # 操作按钮
-                        col_btn1, col_btn2 = st.columns([1, 9])
-                        with col_btn1:
-                            if st.button("编辑", key=f"edit_{row['id']}"):
-                                st.session_state.edit_entry = row['id']
-                        with col_btn2:
-                            if st.button("删除", key=f"delete_{row['id']}"):
-                                if delete_entry(row['id']):
-                                    st.success("日记已删除！")
-                                    st.rerun()
-                        
-                        st.markdown("</div>", unsafe_allow_html=True)
-    
-    # 日历视图
-    elif menu == "日历视图":
-        st.subheader("日历视图")
-        st.info("点击有日记的日期可以查看或编辑那天的日记")
-        
-        # 选择年月
-        today = datetime.date.today()
-        col1, col2 = st.columns(2)
-        with col1:
-            year = st.number_input("选择年份", min_value=2000, max_value=2100, value=today.year)
-        with col2:
-            month = st.selectbox("选择月份", range(1, 13), index=today.month-1)
-        
-        # 生成日历
-        cal_html = generate_calendar(year, month)
-        st.markdown(f"<div class='calendar-container'>{cal_html}</div>", unsafe_allow_html=True)
-        
-        # 显示选定日期的日记
-        if selected_date:
-            entry = get_entry_by_date(selected_date)
             if entry:
-                st.subheader(f"{selected_date} 的日记")
-                st.markdown(f"<div class='diary-entry'>", unsafe_allow_html=True)
-                st.markdown(f"<div class='diary-date'>{entry[1]} <span class='mood-tag'>{entry[4]}</span></div>", unsafe_allow_html=True)
-                st.markdown(f"<div class='diary-title'>{entry[2]}</div>", unsafe_allow_html=True)
-                
-                if entry[5]:
-                    tags_html = "<div style='margin-bottom: 10px;'>"
-                    for tag in entry[5].split(','):
-                        tags_html += f"<span class='tag'>{tag.strip()}</span>"
-                    tags_html += "</div>"
-                    st.markdown(tags_html, unsafe_allow_html=True)
-                
-                st.markdown(f"<div class='diary-content'>{entry[3]}</div>", unsafe_allow_html=True)
-                
-                # 编辑按钮
-                if st.button("编辑这篇日记"):
-                    st.session_state.edit_entry = entry[0]
-                
-                st.markdown("</div>", unsafe_allow_html=True)
-            else:
-                st.info(f"{selected_date} 还没有日记")
-                if st.button(f"为 {selected_date} 写日记"):
-                    # 使用新的 query_params 设置日期
-                    st.query_params["date"] = selected_date
-                    st.rerun()
+                st.subheader("编辑日记")
+                edit_entry_editor(db.current_path(), entry)
     
-    # 搜索日记
-    elif menu == "搜索日记":
-        st.subheader("搜索日记")
-        
-        search_query = st.text_input("搜索内容", placeholder="输入关键词搜索日记...")
-        
-        if search_query:
-            entries_df = get_all_entries()
-            if entries_df.empty:
-                st.info("还没有日记")
-            else:
-                # 执行搜索
-                results = entries_df[
-                    entries_df["标题"].str.contains(search_query, case=False) |
-                    entries_df["内容"].str.contains(search_query, case=False) |
-                    entries_df["标签"].str.contains(search_query, case=False)
-                ]
-                
-                if results.empty:
-                    st.info("没有找到匹配的日记")
-                else:
-                    st.write(f"找到 {len(results)} 篇匹配的日记")
-                    
-                    for _, row in results.iterrows():
-                        with st.container():
-                            st.markdown(f"<div class='diary-entry'>", unsafe_allow_html=True)
-                            
-                            # 日期和心情
-                            st.markdown(f"<div class='diary-date'>{row['日期']} <span class='mood-tag'>{row['心情']}</span></div>", unsafe_allow_html=True)
-                            
-                            # 标题
-                            st.markdown(f"<div class='diary-title'>{row['标题']}</div>", unsafe_allow_html=True)
-                            
-                            # 标签
-                            if row['标签'] and isinstance(row['标签'], str):
-                                tags_html = "<div style='margin-bottom: 10px;'>"
-                                for tag in row['标签'].split(','):
-                                    tags_html += f"<span class='tag'>{tag.strip()}</span>"
-                                tags_html += "</div>"
-                                st.markdown(tags_html, unsafe_allow_html=True)
-                            
-                            # 内容预览
-                            content_preview = row['内容'][:300] + "..." if len(row['内容']) > 300 else row['内容']
-                            st.markdown(f"<div class='diary-content'>{content_preview}</div>", unsafe_allow_html=True)
-                            
-                            # 查看完整日记按钮
-                            if st.button("查看全文", key=f"view_{row['id']}"):
-                                st.session_state.view_entry = row['id']
-                            
-                            st.markdown("</div>", unsafe_allow_html=True)
-    
-    # 关于页面
-    elif menu == "关于":
-        st.subheader("关于个人日记本")
-        
-        st.markdown("""
-            ## 📖 个人日记本软件
-            
-            **个人日记本**是一个专为个人设计的日记记录软件，帮助您：
-            
-            - ✍️ 记录日常生活和重要时刻
-            - 😊 标记心情状态和情感变化
-            - 🏷️ 使用标签整理日记内容
-            - 📅 通过日历视图浏览日记
-            - 🔍 快速搜索过去的日记
-            
-            ### 主要功能
-            
-            1. **写日记**：
-               - 记录每天的所思所想
-               - 标记心情状态
-               - 添加自定义标签
-            
-            2. **看日记**：
-               - 按时间顺序浏览所有日记
-               - 按日期范围、心情、标签筛选
-            
-            3. **日历视图**：
-               - 直观查看有日记的日期
-               - 点击日期查看或编辑日记
-            
-            4. **搜索日记**：
-               - 通过关键词搜索日记内容
-               - 快速找到特定主题的日记
-            
-            ### 隐私保护
-            
-            - 所有数据存储在本地数据库（personal_diary.db）
-            - 无需联网，完全私密
-            - 您的日记只属于您一个人
-            
-            ### 使用说明
-            
-            1. 首次使用会自动创建数据库
-            2. 在"写日记"页面开始记录
-            3. 使用"看日记"或"日历视图"回顾过去的日记
-            4. 使用"搜索日记"查找特定内容
-            
-            **您的所有日记都保存在本地计算机上，请定期备份 personal_diary.db 文件以防数据丢失。**
-        """)
-        
-        st.markdown("---")
-        st.info("个人日记本 v1.0 | 设计: 您的私人记忆守护者 | 2025年")
-
-    # 编辑日记（特殊状态）
-    if 'edit_entry' in st.session_state:
-        entry_id = st.session_state.edit_entry
-        conn = sqlite3.connect('personal_diary.db')
-        c = conn.cursor()
-        c.execute("SELECT * FROM entries WHERE id = ?", (entry_id,))
-        entry = c.fetchone()
-        conn.close()
-        
-        if entry:
-            st.subheader("编辑日记")
-            
-            with st.form("edit_entry_form"):
-                date = st.date_input("日期", value=datetime.date.fromisoformat(entry[1]))
-                title = st.text_input("标题", value=entry[2])
-                
-                mood = st.selectbox("心情", ["😊 开心", "😄 兴奋", "😌 平静", "😢 难过", "😠 生气", "😔 忧郁", "😴 疲惫", "🤔 思考"], 
-                                  index=["😊 开心", "😄 兴奋", "😌 平静", "😢 难过", "😠 生气", "😔 忧郁", "😴 疲惫", "🤔 思考"].index(entry[4]))
-                
-                tags = st.text_input("标签 (用逗号分隔)", value=entry[5])
-                
-                content = st.text_area("日记内容", value=entry[3], height=300)
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    save_btn = st.form_submit_button("保存修改")
-                with col2:
-                    cancel_btn = st.form_submit_button("取消编辑")
-                
-                if save_btn:
-                    date_str = date.isoformat()
-                    if update_entry(entry_id, title, content, mood, tags):
-                        st.success("日记更新成功！")
-                        del st.session_state.edit_entry
-                        st.rerun()
-                
-                if cancel_btn:
-                    del st.session_state.edit_entry
-                    st.rerun()
+    # 性能面板
+    if profiling:
+        render_perf_panel()
 
 # 运行应用
 if __name__ == "__main__":
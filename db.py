@@ -0,0 +1,1277 @@
+import sqlite3
+import threading
+import hashlib
+import os
+import re
+import queue
+import time
+import functools
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import perf
+import revisions
+
+# 数据库文件
+DB_PATH = 'personal_diary.db'
+
+# 多用户模式：设置环境变量 DIARY_SHARDS_DIR 后，每个用户的日记保存在该目录下单独的数据库文件中
+# 注意：这里只按用户名分开存放，没有任何身份验证，知道用户名就能读写该用户的日记；
+# 只适合在可信的网络中使用，或由前面的反向代理负责登录并设置用户名
+SHARDS_DIR = os.environ.get("DIARY_SHARDS_DIR")
+
+# 每个数据库文件的连接池大小（空闲连接的上限）
+POOL_SIZE = 8
+
+# 同时保持打开的数据库文件数，超出时关闭最久未使用的
+MAX_OPEN_SHARDS = 32
+
+# 连接参数
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+]
+
+# 正文超过这个字节数时压缩存储，默认不压缩（设置环境变量 DIARY_COMPRESS_THRESHOLD，例如 1024，开启压缩）
+# 压缩的正文只有本程序能读取，普通的 sqlite3 连接看到的正文为空
+COMPRESS_THRESHOLD = int(os.environ.get("DIARY_COMPRESS_THRESHOLD", "0"))
+
+# zlib 压缩级别
+COMPRESS_LEVEL = 6
+
+# 列表和搜索结果中显示的正文预览长度（字符）
+PREVIEW_LENGTH = 300
+
+
+# 完整正文的 SQL 表达式：压缩的日记在 content_z 中，其他日记在 content 中
+def _full_content_sql(row):
+    return f"CASE WHEN {row}.content_z IS NULL THEN {row}.content ELSE inflate({row}.content_z) END"
+
+
+# 打开单篇日记时返回的列（顺序与 daily.py 中的 DataFrame 列名对应），只有这里解压正文
+ENTRY_COLUMNS = f"id, date, title, {_full_content_sql('entries')}, mood, tags, updated_at"
+
+# 列表中返回的列：正文位置为预览，短日记没有单独的预览，直接取正文
+LIST_COLUMNS = "id, date, title, COALESCE(preview, content), mood, tags, updated_at"
+
+# 查询结果缓存的最大条目数
+CACHE_SIZE = 256
+
+# 写线程数：每个数据库文件有自己的写队列，空闲的写线程轮流处理有待写操作的文件，
+# 同一个文件同时只由一个写线程处理；一个文件的大批写入只占用一个写线程，其他文件由其余写线程处理
+WRITER_THREADS = 4
+
+# 每个数据库文件的写队列长度（队列满时提交写入的调用方会等待）
+WRITE_QUEUE_SIZE = 1000
+
+# 每隔多少个历史版本保存一个完整版本，其他版本保存为差异，限制还原一个版本时需要应用的差异数
+SNAPSHOT_EVERY = 10
+
+# 一次组提交最多合并的写操作数
+WRITE_BATCH_SIZE = 100
+
+# 模块只在进程启动时导入一次，连接池和初始化状态在 Streamlit 的多次重跑和多个会话之间共享
+# 每个打开的数据库文件有自己的连接池，按最近使用顺序保存
+_shards = OrderedDict()
+_shards_lock = threading.Lock()
+
+# 当前线程使用的数据库文件（多用户模式下每次重跑选择当前用户的文件）
+_local = threading.local()
+
+# 查询结果缓存：键为 (数据库文件, 数据版本, 函数名, 参数)，写操作提交后该文件的数据版本变化
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_data_versions = {}
+
+# 写队列：{数据库文件: 待写操作}，只包含有待写操作或正在写入的文件（写完即删除）
+# _ready 为等待写线程处理的文件（轮流处理，每次最多 WRITE_BATCH_SIZE 个操作，处理完仍有剩余时排到队尾）
+_pending_writes = {}
+_ready = deque()
+_write_cond = threading.Condition()
+_writer_lock = threading.Lock()
+_writer_threads = []
+
+# 每个数据库文件最后一次提交写入的时间，后台维护据此判断是否空闲
+_last_write = {}
+
+
+# 解压正文（注册为 SQL 函数 inflate）
+def _inflate(data):
+    if data is None:
+        return None
+    return zlib.decompress(data).decode("utf-8")
+
+
+# 把正文整理成 (content, content_z, preview)：长正文压缩到 content_z，content 留空
+# preview 只在正文超过预览长度或被压缩时保存
+def pack_content(content):
+    preview = None
+    if len(content) > PREVIEW_LENGTH:
+        preview = content[:PREVIEW_LENGTH] + "…"
+    data = content.encode("utf-8")
+    if COMPRESS_THRESHOLD and len(data) >= COMPRESS_THRESHOLD:
+        packed = zlib.compress(data, COMPRESS_LEVEL)
+        if len(packed) < len(data):
+            return "", packed, preview or content
+    return content, None, preview
+
+
+# 连续的文字（字母、数字、汉字），两字词索引只在这些字符内部切分
+_WORD_RUN = re.compile(r"[^\W_]+")
+
+
+# 把文本切成相邻两个字的词，用空格分隔（注册为 SQL 函数 bigrams，供两字词索引使用）
+# 例如 "看医生。" → "看医 医生"；unicode61 分词后每个两字词是一个词元
+def _bigrams(text):
+    if not text:
+        return ""
+    grams = []
+    for run in _WORD_RUN.findall(text.lower()):
+        grams.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return " ".join(grams)
+
+
+# 打开一个新连接并设置参数
+def _open_connection(path):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.create_function("inflate", 1, _inflate, deterministic=True)
+    conn.create_function("bigrams", 1, _bigrams, deterministic=True)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+# 迁移 1：日记表和全文搜索索引
+def _migration_entries(conn):
+    c = conn.cursor()
+
+    # 创建日记表
+    c.execute('''CREATE TABLE IF NOT EXISTS entries (
+                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 date TEXT NOT NULL,
+                 title TEXT NOT NULL,
+                 content TEXT NOT NULL,
+                 mood TEXT NOT NULL,
+                 tags TEXT)''')
+
+    # 创建全文搜索索引（trigram 分词，支持中文子串匹配）
+    c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'entries_fts'")
+    fts_exists = c.fetchone() is not None
+    c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+                 title, content, tags,
+                 content='entries', content_rowid='id',
+                 tokenize='trigram')''')
+
+    # 触发器：保持搜索索引与日记表同步
+    c.execute('''CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN
+                 INSERT INTO entries_fts (rowid, title, content, tags)
+                 VALUES (new.id, new.title, new.content, new.tags);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN
+                 INSERT INTO entries_fts (entries_fts, rowid, title, content, tags)
+                 VALUES ('delete', old.id, old.title, old.content, old.tags);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS entries_au AFTER UPDATE ON entries BEGIN
+                 INSERT INTO entries_fts (entries_fts, rowid, title, content, tags)
+                 VALUES ('delete', old.id, old.title, old.content, old.tags);
+                 INSERT INTO entries_fts (rowid, title, content, tags)
+                 VALUES (new.id, new.title, new.content, new.tags);
+                 END''')
+
+    # 首次创建索引时为已有日记建立索引
+    if not fts_exists:
+        c.execute("INSERT INTO entries_fts (entries_fts) VALUES ('rebuild')")
+
+
+# 迁移 2：日期和心情索引，用于筛选和分页
+def _migration_date_index(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_date_id ON entries (date, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_mood_date_id ON entries (mood, date, id)")
+
+
+# 拆分逗号分隔的标签字符串（去掉首尾空格和重复）
+def split_tags(tags):
+    if not tags:
+        return []
+    names = []
+    for tag in tags.split(','):
+        tag = tag.strip()
+        if tag and tag not in names:
+            names.append(tag)
+    return names
+
+
+# 写入一篇日记的标签关联，标签计数由触发器维护
+def _set_entry_tags(conn, entry_id, tags):
+    conn.execute("DELETE FROM entry_tags WHERE entry_id = ?", (entry_id,))
+    names = split_tags(tags)
+    if not names:
+        return
+    conn.executemany("INSERT OR IGNORE INTO tags (name) VALUES (?)", [(name,) for name in names])
+    conn.executemany('''INSERT INTO entry_tags (entry_id, tag_id)
+                        SELECT ?, id FROM tags WHERE name = ?''', [(entry_id, name) for name in names])
+
+
+# 迁移 3：规范化的标签表，并迁移已有的逗号分隔标签
+def _migration_tags(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS tags (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE,
+                    entry_count INTEGER NOT NULL DEFAULT 0)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS entry_tags (
+                    entry_id INTEGER NOT NULL,
+                    tag_id INTEGER NOT NULL,
+                    PRIMARY KEY (entry_id, tag_id)) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_entry_tags_tag ON entry_tags (tag_id, entry_id)")
+
+    # 触发器：维护每个标签的日记数，删除日记时清理关联
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS entry_tags_ai AFTER INSERT ON entry_tags BEGIN
+                    UPDATE tags SET entry_count = entry_count + 1 WHERE id = new.tag_id;
+                    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS entry_tags_ad AFTER DELETE ON entry_tags BEGIN
+                    UPDATE tags SET entry_count = entry_count - 1 WHERE id = old.tag_id;
+                    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS entries_tags_ad AFTER DELETE ON entries BEGIN
+                    DELETE FROM entry_tags WHERE entry_id = old.id;
+                    END''')
+
+    # 迁移已有日记的标签
+    rows = conn.execute("SELECT id, tags FROM entries WHERE tags IS NOT NULL AND tags != ''").fetchall()
+    for entry_id, tags in rows:
+        _set_entry_tags(conn, entry_id, tags)
+
+
+# 重新计算某一天的汇总（日记数和出现最多的心情），day 为触发器中的日期表达式
+def _refresh_day_sql(day):
+    return f'''INSERT OR REPLACE INTO daily_summary (date, entry_count, mood)
+              SELECT {day}, COUNT(*),
+                     (SELECT mood FROM entries WHERE date = {day}
+                      GROUP BY mood ORDER BY COUNT(*) DESC, MAX(id) DESC LIMIT 1)
+              FROM entries WHERE date = {day};
+              DELETE FROM daily_summary WHERE date = {day} AND entry_count = 0;'''
+
+
+# 迁移 4：按天汇总表，写入日记时由触发器维护
+def _migration_daily_summary(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS daily_summary (
+                    date TEXT PRIMARY KEY,
+                    entry_count INTEGER NOT NULL,
+                    mood TEXT) WITHOUT ROWID''')
+
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS entries_summary_ai AFTER INSERT ON entries BEGIN
+                    {_refresh_day_sql("new.date")}
+                    END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS entries_summary_ad AFTER DELETE ON entries BEGIN
+                    {_refresh_day_sql("old.date")}
+                    END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS entries_summary_au AFTER UPDATE OF date, mood ON entries BEGIN
+                    {_refresh_day_sql("old.date")}
+                    {_refresh_day_sql("new.date")}
+                    END''')
+
+    # 汇总已有日记
+    conn.execute("DELETE FROM daily_summary")
+    conn.execute('''INSERT INTO daily_summary (date, entry_count, mood)
+                    SELECT d.date, d.n,
+                           (SELECT mood FROM entries WHERE date = d.date
+                            GROUP BY mood ORDER BY COUNT(*) DESC, MAX(id) DESC LIMIT 1)
+                    FROM (SELECT date, COUNT(*) AS n FROM entries GROUP BY date) d''')
+
+
+# 迁移 5：记录每篇日记的最后修改时间，用于缓存渲染结果
+def _migration_updated_at(conn):
+    conn.execute("ALTER TABLE entries ADD COLUMN updated_at REAL NOT NULL DEFAULT 0")
+
+
+# 迁移 6：批量导入进度，用于断点续传
+def _migration_import_progress(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS import_progress (
+                    source TEXT PRIMARY KEY,
+                    done INTEGER NOT NULL,
+                    updated_at REAL NOT NULL)''')
+
+
+# 按月心情计数和按周日记数的增减语句，row 为 new 或 old，delta 为 1 或 -1
+def _stats_delta_sql(row, delta):
+    return f'''INSERT INTO mood_monthly (month, mood, entry_count) VALUES (substr({row}.date, 1, 7), {row}.mood, {delta})
+                  ON CONFLICT (month, mood) DO UPDATE SET entry_count = entry_count + ({delta});
+              INSERT INTO weekly_counts (week, entry_count) VALUES (date({row}.date, 'weekday 0', '-6 days'), {delta})
+                  ON CONFLICT (week) DO UPDATE SET entry_count = entry_count + ({delta});'''
+
+
+# 迁移 7：统计页使用的汇总表（按月心情计数、按周日记数），由触发器增量维护
+def _migration_stats(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS mood_monthly (
+                    month TEXT NOT NULL,
+                    mood TEXT NOT NULL,
+                    entry_count INTEGER NOT NULL,
+                    PRIMARY KEY (month, mood)) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS weekly_counts (
+                    week TEXT PRIMARY KEY,
+                    entry_count INTEGER NOT NULL) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tags_entry_count ON tags (entry_count)")
+
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS entries_stats_ai AFTER INSERT ON entries BEGIN
+                    {_stats_delta_sql("new", 1)}
+                    END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS entries_stats_ad AFTER DELETE ON entries BEGIN
+                    {_stats_delta_sql("old", -1)}
+                    END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS entries_stats_au AFTER UPDATE OF date, mood ON entries BEGIN
+                    {_stats_delta_sql("old", -1)}
+                    {_stats_delta_sql("new", 1)}
+                    END''')
+
+    # 汇总已有日记
+    conn.execute("DELETE FROM mood_monthly")
+    conn.execute("DELETE FROM weekly_counts")
+    conn.execute('''INSERT INTO mood_monthly (month, mood, entry_count)
+                    SELECT substr(date, 1, 7), mood, COUNT(*) FROM entries GROUP BY 1, 2''')
+    conn.execute('''INSERT INTO weekly_counts (week, entry_count)
+                    SELECT date(date, 'weekday 0', '-6 days'), COUNT(*) FROM entries GROUP BY 1''')
+
+
+# 迁移 8：长正文压缩存储（只在开启压缩时），并保存列表用的预览
+# 搜索索引改为以视图 entries_text（解压后的正文）为外部内容表，只在重建索引时读取，索引本身不变但需要重建
+# 索引由写入日记的代码维护（见 _index_entry），最初版本用触发器调用 inflate()，由迁移 14 删除
+def _migration_compression(conn):
+    for trigger in ("entries_ai", "entries_ad", "entries_au"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS entries_fts")
+    conn.execute("ALTER TABLE entries ADD COLUMN content_z BLOB")
+    conn.execute("ALTER TABLE entries ADD COLUMN preview TEXT")
+
+    # 分批处理已有日记，避免一次读入全部正文
+    last_id = 0
+    while True:
+        rows = conn.execute("SELECT id, content FROM entries WHERE id > ? ORDER BY id LIMIT 1000", (last_id,)).fetchall()
+        if not rows:
+            break
+        conn.executemany("UPDATE entries SET content = ?, content_z = ?, preview = ? WHERE id = ?",
+                         [pack_content(content) + (entry_id,) for entry_id, content in rows])
+        last_id = rows[-1][0]
+
+    conn.execute(f'''CREATE VIEW IF NOT EXISTS entries_text AS
+                     SELECT id, title, {_full_content_sql("entries")} AS content, tags FROM entries''')
+    conn.execute('''CREATE VIRTUAL TABLE entries_fts USING fts5(
+                    title, content, tags,
+                    content='entries_text', content_rowid='id',
+                    tokenize='trigram')''')
+    conn.execute("INSERT INTO entries_fts (entries_fts) VALUES ('rebuild')")
+
+
+# 迁移 9：自动保存的草稿，key 为 "new"（写新日记）或 "entry:<id>"（编辑日记）
+def _migration_drafts(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS drafts (
+                    key TEXT PRIMARY KEY,
+                    entry_id INTEGER,
+                    date TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    mood TEXT NOT NULL,
+                    tags TEXT NOT NULL,
+                    updated_at REAL NOT NULL)''')
+
+
+# 迁移 10：按修改时间查找新增和修改过的日记（相关日记索引增量更新用，由迁移 15 的修改序号代替）
+def _migration_updated_at_index(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_updated_at ON entries (updated_at, id)")
+
+
+# 迁移 11：日记的历史版本（只追加），删除日记时一并删除
+# 每个版本保存为相对下一个版本的差异（反向差异），当前版本就在日记表中；每 SNAPSHOT_EVERY 个版本保存一个完整版本
+def _migration_revisions(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS revisions (
+                    entry_id INTEGER NOT NULL,
+                    rev INTEGER NOT NULL,
+                    is_full INTEGER NOT NULL,
+                    data BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (entry_id, rev)) WITHOUT ROWID''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS entries_revisions_ad AFTER DELETE ON entries BEGIN
+                    DELETE FROM revisions WHERE entry_id = old.id;
+                    END''')
+
+
+# 迁移 12：两字词搜索索引。trigram 索引只能匹配 3 个字及以上的关键词，而中文词大多是两个字，
+# 这里把文本切成相邻两字的词（外部内容为视图 entries_bigrams，只在重建索引时读取），两个字的关键词也走索引
+# 索引由写入日记的代码维护（见 _index_entry），最初版本用触发器调用 bigrams()，由迁移 13 删除
+def _migration_bigram_index(conn):
+    conn.execute(f'''CREATE VIEW IF NOT EXISTS entries_bigrams AS
+                     SELECT id, bigrams(title) AS title, bigrams({_full_content_sql("entries")}) AS content,
+                            bigrams(tags) AS tags
+                     FROM entries''')
+    conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS entries_bigram_fts USING fts5(
+                    title, content, tags,
+                    content='entries_bigrams', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 0')''')
+    conn.execute("INSERT INTO entries_bigram_fts (entries_bigram_fts) VALUES ('rebuild')")
+
+
+# 迁移 13：删除两字词索引的触发器。触发器中调用的 bigrams() 是本程序注册的函数，
+# 普通的 sqlite3 连接（命令行工具、备份脚本等）写入或删除日记时会出错 "no such function: bigrams"
+def _migration_drop_bigram_triggers(conn):
+    for trigger in ("entries_bigram_ai", "entries_bigram_ad", "entries_bigram_au"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+
+# 迁移 14：删除搜索索引调用 inflate() 的触发器（原因同迁移 13），
+# 压缩改为默认关闭后，把迁移 8 压缩过的正文还原为明文，普通的 sqlite3 连接也能读取完整正文
+# 搜索索引中的文本不变，不需要更新
+def _migration_plain_content(conn):
+    for trigger in ("entries_ai", "entries_ad", "entries_au"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    if not COMPRESS_THRESHOLD:
+        _decompress_rows(conn)
+
+
+# 把压缩存储的正文还原为明文（分批处理，避免一次读入全部正文），返回还原的篇数
+def _decompress_rows(conn):
+    count = 0
+    last_id = 0
+    while True:
+        rows = conn.execute("SELECT id, content_z FROM entries WHERE id > ? AND content_z IS NOT NULL ORDER BY id LIMIT 1000",
+                            (last_id,)).fetchall()
+        if not rows:
+            return count
+        conn.executemany("UPDATE entries SET content = ?, content_z = NULL, preview = ? WHERE id = ?",
+                         [(text, pack_content(text)[2], entry_id) for entry_id, text in
+                          ((entry_id, _inflate(data)) for entry_id, data in rows)])
+        count += len(rows)
+        last_id = rows[-1][0]
+
+
+# 迁移 15：日记的修改序号（相关日记索引增量更新用），新增和修改日记时由触发器在写事务内分配，按提交的顺序递增
+# 修改时间在进入写队列之前取得（bulk.py 一次写入一批），也可能来自其他进程，
+# 按修改时间查找会漏掉修改时间较早但提交较晚的日记。代替迁移 10 的索引
+def _migration_change_seq(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS change_counter (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    seq INTEGER NOT NULL)''')
+    conn.execute("ALTER TABLE entries ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0")
+    # 已有日记按修改时间编号
+    conn.execute('''UPDATE entries SET change_seq = ordered.seq
+                    FROM (SELECT id, ROW_NUMBER() OVER (ORDER BY updated_at, id) AS seq FROM entries) AS ordered
+                    WHERE entries.id = ordered.id''')
+    conn.execute("INSERT INTO change_counter (id, seq) SELECT 1, COUNT(*) FROM entries")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_change_seq ON entries (change_seq)")
+    conn.execute("DROP INDEX IF EXISTS idx_entries_updated_at")
+    for trigger, event in (("entries_change_ai", "INSERT"), ("entries_change_au", "UPDATE OF title, content, content_z, tags")):
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS {trigger} AFTER {event} ON entries BEGIN
+                        UPDATE change_counter SET seq = seq + 1;
+                        UPDATE entries SET change_seq = (SELECT seq FROM change_counter) WHERE id = new.id;
+                        END''')
+
+
+# 按顺序执行的数据库迁移，已执行的版本记录在 PRAGMA user_version 中
+MIGRATIONS = [
+    _migration_entries,
+    _migration_date_index,
+    _migration_tags,
+    _migration_daily_summary,
+    _migration_updated_at,
+    _migration_import_progress,
+    _migration_stats,
+    _migration_compression,
+    _migration_drafts,
+    _migration_updated_at_index,
+    _migration_revisions,
+    _migration_bigram_index,
+    _migration_drop_bigram_triggers,
+    _migration_plain_content,
+    _migration_change_seq,
+]
+
+
+# 执行尚未应用的迁移，每个迁移一个事务
+# 多个进程（界面、api.py、bulk.py）可能同时启动：取得写锁（BEGIN IMMEDIATE）之后重新读取版本号，
+# 等待写锁期间其他进程已经执行过的迁移不会再执行一次
+def _migrate(conn):
+    while conn.execute("PRAGMA user_version").fetchone()[0] < len(MIGRATIONS):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < len(MIGRATIONS):
+                MIGRATIONS[version](conn)
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+# 一个数据库文件的连接池和初始化状态
+class _Shard:
+    def __init__(self, path):
+        self.path = path
+        self.pool = queue.LifoQueue(maxsize=POOL_SIZE)
+        self.lock = threading.Lock()
+        self.initialized = False
+        self.closed = False
+        # 只用来读取 PRAGMA data_version 的连接：它自己从不写入，
+        # 所以任何其他连接（包括其他进程）提交写入后它读到的值都会变化
+        self.watcher = None
+        self.watcher_lock = threading.Lock()
+
+    # 数据库文件的修改计数（其他连接或进程提交写入后变化）
+    def file_version(self):
+        with self.watcher_lock:
+            if self.closed:
+                return None
+            if self.watcher is None:
+                self.watcher = _open_connection(self.path)
+            return self.watcher.execute("PRAGMA data_version").fetchone()[0]
+
+    # 关闭空闲连接；借出的连接归还时关闭
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
+        with self.watcher_lock:
+            if self.watcher is not None:
+                self.watcher.close()
+                self.watcher = None
+
+
+# 用户对应的数据库文件：按用户名哈希分到子目录中，避免一个目录下文件过多
+def shard_path(user, shards_dir=None):
+    digest = hashlib.sha1(user.encode("utf-8")).hexdigest()
+    safe_name = re.sub(r"[^\w-]", "_", user)[:40]
+    return os.path.join(shards_dir or SHARDS_DIR, digest[:2], f"{safe_name}-{digest[:8]}.db")
+
+
+# 当前线程使用的数据库文件
+def current_path():
+    return getattr(_local, "path", None) or DB_PATH
+
+
+# 为当前线程选择数据库文件，path 为 None 时使用默认的 DB_PATH
+def select_database(path):
+    _local.path = path
+
+
+# 多用户模式下为当前线程选择用户的数据库文件
+def use_shard(user):
+    select_database(shard_path(user) if SHARDS_DIR and user else None)
+
+
+# 获取数据库文件的连接池，超出 MAX_OPEN_SHARDS 时关闭最久未使用的
+def _get_shard(path):
+    with _shards_lock:
+        shard = _shards.get(path)
+        if shard is not None:
+            _shards.move_to_end(path)
+            return shard
+        shard = _shards[path] = _Shard(path)
+        while len(_shards) > MAX_OPEN_SHARDS:
+            _, evicted = _shards.popitem(last=False)
+            evicted.close()
+            _drop_cache(evicted.path)
+    return shard
+
+
+# 初始化数据库文件（每个进程每个文件只执行一次，首次使用时才创建表）
+def _init_shard(shard):
+    if shard.initialized:
+        return
+    with shard.lock:
+        if shard.initialized:
+            return
+        directory = os.path.dirname(shard.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = _open_connection(shard.path)
+        try:
+            _migrate(conn)
+        finally:
+            conn.close()
+        shard.initialized = True
+
+
+# 初始化当前数据库
+def init_db():
+    _init_shard(_get_shard(current_path()))
+
+
+# 从连接池借出一个连接，用完后归还
+@contextmanager
+def connection():
+    shard = _get_shard(current_path())
+    _init_shard(shard)
+    try:
+        conn = shard.pool.get_nowait()
+    except queue.Empty:
+        conn = _open_connection(shard.path)
+    # 开启性能记录时收集执行的 SQL
+    conn.set_trace_callback(perf.trace if perf.active() else None)
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        if shard.closed:
+            conn.close()
+        else:
+            try:
+                shard.pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+
+# 在一个事务中执行写操作，出错时回滚
+@contextmanager
+def transaction():
+    with connection() as conn:
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        _bump_version(current_path())
+
+
+# 数据库文件的数据版本：(本进程的写入计数, 文件的修改计数)
+# 后者让其他进程（bulk.py 导入、api.py、shard_tool.py）的写入也能使缓存失效
+def _version(path):
+    shard = _get_shard(path)
+    _init_shard(shard)
+    return _data_versions.get(path, 0), shard.file_version()
+
+
+# 当前数据库的数据版本
+def data_version():
+    return _version(current_path())
+
+
+# 记录数据库文件最后一次写入的时间；已关闭的文件不记录，_last_write 只包含打开的文件
+def _note_write(path):
+    with _shards_lock:
+        if path in _shards:
+            _last_write[path] = time.time()
+
+
+# 数据变化后记录写入时间、更新版本号，并删除该数据库文件的旧缓存
+def _bump_version(path):
+    _note_write(path)
+    with _cache_lock:
+        _data_versions[path] = _data_versions.get(path, 0) + 1
+        for key in [key for key in _cache if key[0] == path]:
+            del _cache[key]
+
+
+# 删除一个数据库文件的缓存、版本号和写入时间（关闭该文件时调用）
+def _drop_cache(path):
+    _last_write.pop(path, None)
+    with _cache_lock:
+        _data_versions.pop(path, None)
+        for key in [key for key in _cache if key[0] == path]:
+            del _cache[key]
+
+
+# 把列表参数转换成可哈希的元组，用作缓存键
+def _freeze(value):
+    if isinstance(value, (list, set)):
+        return tuple(value)
+    return value
+
+
+# 缓存只读查询的结果（LRU 淘汰），数据版本变化后自动失效
+# 调用方不能修改返回的结果
+def cached_query(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # 先读取版本号再查询，查询期间发生的写入只会让这条缓存永远不被命中
+        # 每次都检查文件的修改计数，其他进程写入后不会返回旧结果
+        path = current_path()
+        version = _version(path)
+        key = (path, version, func.__name__,
+               tuple(_freeze(a) for a in args),
+               tuple(sorted((k, _freeze(v)) for k, v in kwargs.items())))
+        with _cache_lock:
+            if key in _cache:
+                _cache.move_to_end(key)
+                _cache_stats["hits"] += 1
+                return _cache[key]
+            _cache_stats["misses"] += 1
+
+        result = func(*args, **kwargs)
+
+        with _cache_lock:
+            if version[0] == _data_versions.get(path, 0):
+                _cache[key] = result
+                if len(_cache) > CACHE_SIZE:
+                    _cache.popitem(last=False)
+                    _cache_stats["evictions"] += 1
+        return result
+    return wrapper
+
+
+# 缓存命中情况
+def cache_info():
+    with _cache_lock:
+        return dict(_cache_stats, size=len(_cache), maxsize=CACHE_SIZE, version=_data_versions.get(current_path(), 0))
+
+
+# 清空缓存和计数
+def cache_clear():
+    with _cache_lock:
+        _cache.clear()
+        for name in _cache_stats:
+            _cache_stats[name] = 0
+
+
+# 当前打开的数据库文件（按最近使用顺序）
+def open_paths():
+    with _shards_lock:
+        return list(_shards)
+
+
+# 数据库文件最后一次提交写入的时间，本进程没有写入过时为 0
+def last_write_time(path):
+    return _last_write.get(path, 0)
+
+
+# 关闭所有数据库文件的空闲连接
+def close_all():
+    with _shards_lock:
+        shards = list(_shards.values())
+        _shards.clear()
+    for shard in shards:
+        shard.close()
+        _drop_cache(shard.path)
+
+
+# 切换到另一个数据库文件（命令行工具和基准测试使用）
+def use_database(path):
+    global DB_PATH
+    close_all()
+    DB_PATH = path
+
+
+# 启动写线程（只启动一次）
+def _ensure_writers():
+    if _writer_threads:
+        return
+    with _writer_lock:
+        if not _writer_threads:
+            for i in range(WRITER_THREADS):
+                thread = threading.Thread(target=_writer_loop, name=f"diary-writer-{i}", daemon=True)
+                thread.start()
+                _writer_threads.append(thread)
+
+
+# 提交一个写操作，返回 Future；func(conn, *args) 在写线程中执行
+# invalidate 为 False 表示不影响任何缓存的查询（如草稿），提交后不使查询缓存失效
+def submit_write(func, *args, invalidate=True):
+    path = current_path()
+    _init_shard(_get_shard(path))
+    _ensure_writers()
+    future = Future()
+    with _write_cond:
+        while len(_pending_writes.get(path, ())) >= WRITE_QUEUE_SIZE:
+            _write_cond.wait()
+        if path not in _pending_writes:
+            _pending_writes[path] = deque()
+            _ready.append(path)
+            _write_cond.notify_all()
+        _pending_writes[path].append((func, args, future, invalidate))
+    return future
+
+
+# 在写线程中执行一批写操作：同一个数据库的操作在一个事务中提交
+# 每个操作有自己的保存点，一个操作失败只回滚它自己，其他操作照常提交
+def _run_batch(conn, path, tasks):
+    outcomes = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for func, args, future, _ in tasks:
+            conn.execute("SAVEPOINT write_task")
+            try:
+                result = func(conn, *args)
+                conn.execute("RELEASE write_task")
+                outcomes.append((future, result, None))
+            except Exception as e:
+                conn.execute("ROLLBACK TO write_task")
+                conn.execute("RELEASE write_task")
+                outcomes.append((future, None, e))
+        conn.execute("COMMIT")
+    except Exception as e:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        for future, _, _ in outcomes:
+            future.set_exception(e)
+        for _, _, future, _ in tasks[len(outcomes):]:
+            future.set_exception(e)
+        return
+
+    if any(invalidate for _, _, _, invalidate in tasks):
+        _bump_version(path)
+    else:
+        _note_write(path)
+    for future, result, error in outcomes:
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+
+# 写线程：轮流取出一个有待写操作的数据库文件，把它最多 WRITE_BATCH_SIZE 个操作在一个事务中提交，
+# 还有剩余时把文件排到队尾，让其他文件先写
+# 每个写线程最多保持 MAX_OPEN_SHARDS 个写连接，超出时关闭最久未使用的
+def _writer_loop():
+    connections = OrderedDict()
+    while True:
+        with _write_cond:
+            while not _ready:
+                _write_cond.wait()
+            path = _ready.popleft()
+            pending = _pending_writes[path]
+            batch = [pending.popleft() for _ in range(min(len(pending), WRITE_BATCH_SIZE))]
+            _write_cond.notify_all()
+
+        tasks = [task for task in batch if task[2].set_running_or_notify_cancel()]
+        try:
+            if tasks:
+                if path in connections:
+                    connections.move_to_end(path)
+                else:
+                    conn = _open_connection(path)
+                    conn.isolation_level = None
+                    connections[path] = conn
+                    while len(connections) > MAX_OPEN_SHARDS:
+                        connections.popitem(last=False)[1].close()
+                _run_batch(connections[path], path, tasks)
+        except Exception as e:
+            for _, _, future, _ in tasks:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            with _write_cond:
+                if _pending_writes[path]:
+                    _ready.append(path)
+                    _write_cond.notify_all()
+                else:
+                    del _pending_writes[path]
+
+
+# 更新一篇日记的搜索索引（trigram 索引和两字词索引，在写线程的事务中调用）：
+# old 为索引中原来的 (title, content, tags)，new 为新的内容（都是解压后的正文），新增日记时 old 为 None，删除日记时 new 为 None
+# 在 Python 中直接写入，不用触发器，这样普通的 sqlite3 连接也能写入日记表（但不会更新索引，见 rebuild_search_index）
+def _index_entry(conn, entry_id, old, new):
+    if old is not None:
+        conn.execute('''INSERT INTO entries_fts (entries_fts, rowid, title, content, tags)
+                        VALUES ('delete', ?, ?, ?, ?)''', (entry_id, *old))
+        conn.execute('''INSERT INTO entries_bigram_fts (entries_bigram_fts, rowid, title, content, tags)
+                        VALUES ('delete', ?, ?, ?, ?)''', (entry_id, *(_bigrams(value) for value in old)))
+    if new is not None:
+        conn.execute("INSERT INTO entries_fts (rowid, title, content, tags) VALUES (?, ?, ?, ?)", (entry_id, *new))
+        conn.execute("INSERT INTO entries_bigram_fts (rowid, title, content, tags) VALUES (?, ?, ?, ?)",
+                     (entry_id, *(_bigrams(value) for value in new)))
+
+
+# 重建搜索索引：其他程序直接写入日记表后，搜索索引不会自动更新，需要重建
+def rebuild_search_index():
+    with transaction() as conn:
+        for table in ("entries_fts", "entries_bigram_fts"):
+            conn.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+
+
+# 把压缩存储的正文全部还原为明文（关闭压缩后使用），返回还原的篇数
+def decompress_entries():
+    with transaction() as conn:
+        return _decompress_rows(conn)
+
+
+# 添加新日记（在写线程中执行），返回新日记的 id；draft_key 不为 None 时同时删除对应的草稿
+def _add_entry(conn, date, title, content, mood, tags, draft_key=None):
+    c = conn.execute('''INSERT INTO entries (date, title, content, content_z, preview, mood, tags, updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                     (date, title, *pack_content(content), mood, tags, time.time()))
+    _set_entry_tags(conn, c.lastrowid, tags)
+    _index_entry(conn, c.lastrowid, None, (title, content, tags))
+    if draft_key is not None:
+        _delete_draft(conn, draft_key)
+    return c.lastrowid
+
+
+# 把日记修改前的版本 old = (title, content, mood, tags, updated_at) 保存为历史版本：
+# 相对修改后版本的差异，或每 SNAPSHOT_EVERY 个版本一个完整版本
+# created_at 为该版本的修改时间；迁移 5 之前写入、之后没有修改过的日记没有修改时间，记为 0（未知）
+def _record_revision(conn, entry_id, old, title, content, mood, tags):
+    if old[:4] == (title, content, mood, tags):
+        return
+    old_text = revisions.pack_version(*old[:4])
+    rev = conn.execute("SELECT COALESCE(MAX(rev), 0) + 1 FROM revisions WHERE entry_id = ?", (entry_id,)).fetchone()[0]
+    if rev % SNAPSHOT_EVERY == 0:
+        is_full, data = 1, revisions.encode_full(old_text)
+    else:
+        new_text = revisions.pack_version(title, content, mood, tags)
+        is_full, data = 0, revisions.encode_delta(revisions.diff(new_text, old_text))
+    conn.execute("INSERT INTO revisions (entry_id, rev, is_full, data, created_at) VALUES (?, ?, ?, ?, ?)",
+                 (entry_id, rev, is_full, data, old[4]))
+
+
+# 更新日记（在写线程中执行），修改前的内容保存为历史版本；draft_key 不为 None 时同时删除对应的草稿
+def _update_entry(conn, entry_id, title, content, mood, tags, draft_key=None):
+    old = conn.execute(f"SELECT title, {_full_content_sql('entries')}, mood, tags, updated_at FROM entries WHERE id = ?",
+                       (entry_id,)).fetchone()
+    if old is not None:
+        _record_revision(conn, entry_id, old, title, content, mood, tags)
+        _index_entry(conn, entry_id, (old[0], old[1], old[3]), (title, content, tags))
+    conn.execute('''UPDATE entries SET title = ?, content = ?, content_z = ?, preview = ?, mood = ?, tags = ?, updated_at = ?
+                    WHERE id = ?''', (title, *pack_content(content), mood, tags, time.time(), entry_id))
+    _set_entry_tags(conn, entry_id, tags)
+    if draft_key is not None:
+        _delete_draft(conn, draft_key)
+
+
+# 删除日记（在写线程中执行）
+def _delete_entry(conn, entry_id):
+    old = conn.execute(f"SELECT title, {_full_content_sql('entries')}, tags FROM entries WHERE id = ?",
+                       (entry_id,)).fetchone()
+    if old is not None:
+        _index_entry(conn, entry_id, old, None)
+    conn.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+
+
+# 恢复历史版本（在写线程中执行）：作为一次新的修改，当前内容也会保存为历史版本
+def _restore_revision(conn, entry_id, rev):
+    version = _load_revision(conn, entry_id, rev)
+    if version is None:
+        raise ValueError(f"日记 {entry_id} 没有版本 {rev}")
+    _update_entry(conn, entry_id, *version)
+
+
+# 提交添加日记，返回 Future（结果为新日记的 id）
+def add_entry_async(date, title, content, mood, tags, draft_key=None):
+    return submit_write(_add_entry, date, title, content, mood, tags, draft_key)
+
+
+# 提交更新日记，返回 Future
+def update_entry_async(entry_id, title, content, mood, tags, draft_key=None):
+    return submit_write(_update_entry, entry_id, title, content, mood, tags, draft_key)
+
+
+# 提交删除日记，返回 Future
+def delete_entry_async(entry_id):
+    return submit_write(_delete_entry, entry_id)
+
+
+# 添加新日记，返回新日记的 id
+@perf.timed
+def add_entry(date, title, content, mood, tags, draft_key=None):
+    return add_entry_async(date, title, content, mood, tags, draft_key).result()
+
+
+# 更新日记
+@perf.timed
+def update_entry(entry_id, title, content, mood, tags, draft_key=None):
+    return update_entry_async(entry_id, title, content, mood, tags, draft_key).result()
+
+
+# 删除日记
+@perf.timed
+def delete_entry(entry_id):
+    return delete_entry_async(entry_id).result()
+
+
+# 保存草稿（在写线程中执行）
+def _save_draft(conn, key, entry_id, date, title, content, mood, tags, updated_at):
+    conn.execute('''INSERT OR REPLACE INTO drafts (key, entry_id, date, title, content, mood, tags, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', (key, entry_id, date, title, content, mood, tags, updated_at))
+
+
+# 删除草稿（在写线程中执行）
+def _delete_draft(conn, key):
+    conn.execute("DELETE FROM drafts WHERE key = ?", (key,))
+
+
+# 提交保存草稿，返回 Future（草稿不影响查询缓存）
+def save_draft_async(key, entry_id, date, title, content, mood, tags):
+    return submit_write(_save_draft, key, entry_id, date, title, content, mood, tags, time.time(), invalidate=False)
+
+
+# 删除草稿
+@perf.timed
+def delete_draft(key):
+    return submit_write(_delete_draft, key, invalidate=False).result()
+
+
+# 获取草稿：(entry_id, date, title, content, mood, tags, updated_at)，没有时返回 None
+# 草稿的写入不更新数据版本，所以不经过查询缓存
+@perf.timed
+def get_draft(key):
+    with connection() as conn:
+        return conn.execute("SELECT entry_id, date, title, content, mood, tags, updated_at FROM drafts WHERE key = ?",
+                            (key,)).fetchone()
+
+
+# 还原一个历史版本：(title, content, mood, tags)，不存在时返回 None
+# 从该版本之后最近的完整版本（没有时从当前日记）开始，依次应用反向差异
+def _load_revision(conn, entry_id, rev):
+    snapshot = -(-rev // SNAPSHOT_EVERY) * SNAPSHOT_EVERY
+    rows = conn.execute('''SELECT rev, is_full, data FROM revisions
+                           WHERE entry_id = ? AND rev BETWEEN ? AND ? ORDER BY rev DESC''',
+                        (entry_id, rev, snapshot)).fetchall()
+    if not rows or rows[-1][0] != rev:
+        return None
+    if rows[0][1]:
+        text = revisions.decode_full(rows[0][2])
+        rows = rows[1:]
+    else:
+        current = conn.execute(f"SELECT title, {_full_content_sql('entries')}, mood, tags FROM entries WHERE id = ?",
+                               (entry_id,)).fetchone()
+        text = revisions.pack_version(*current)
+    for _, _, data in rows:
+        text = revisions.patch(text, revisions.decode_delta(data))
+    return revisions.unpack_version(text)
+
+
+# 日记的历史版本：[(版本号, 是否完整版本, 保存的字节数, 该版本的修改时间)]，新的在前；修改时间未知时为 0
+@perf.timed
+@cached_query
+def list_revisions(entry_id):
+    with connection() as conn:
+        return conn.execute('''SELECT rev, is_full, length(data), created_at FROM revisions
+                               WHERE entry_id = ? ORDER BY rev DESC''', (entry_id,)).fetchall()
+
+
+# 获取一个历史版本：(title, content, mood, tags)
+@perf.timed
+@cached_query
+def get_revision(entry_id, rev):
+    with connection() as conn:
+        return _load_revision(conn, entry_id, rev)
+
+
+# 恢复历史版本
+@perf.timed
+def restore_revision(entry_id, rev):
+    return submit_write(_restore_revision, entry_id, rev).result()
+
+
+# 获取所有日记（正文为预览）
+@perf.timed
+@cached_query
+def get_all_entries():
+    with connection() as conn:
+        return conn.execute(f"SELECT {LIST_COLUMNS} FROM entries ORDER BY date DESC").fetchall()
+
+
+# 按 id 获取日记
+@perf.timed
+@cached_query
+def get_entry(entry_id):
+    with connection() as conn:
+        return conn.execute(f"SELECT {ENTRY_COLUMNS} FROM entries WHERE id = ?", (entry_id,)).fetchone()
+
+
+# 按 id 获取多篇日记（正文为预览），按传入的顺序返回
+@perf.timed
+@cached_query
+def get_entries(entry_ids):
+    with connection() as conn:
+        rows = conn.execute(f"SELECT {LIST_COLUMNS} FROM entries WHERE id IN ({', '.join('?' * len(entry_ids))})",
+                            list(entry_ids)).fetchall()
+    by_id = {row[0]: row for row in rows}
+    return [by_id[entry_id] for entry_id in entry_ids if entry_id in by_id]
+
+
+# 按日期获取日记
+@perf.timed
+@cached_query
+def get_entry_by_date(date):
+    with connection() as conn:
+        return conn.execute(f"SELECT {ENTRY_COLUMNS} FROM entries WHERE date = ?", (date,)).fetchone()
+
+
+# 日记的最早日期、最晚日期和总数
+@perf.timed
+@cached_query
+def get_date_bounds():
+    with connection() as conn:
+        return conn.execute("SELECT MIN(date), MAX(date), COUNT(*) FROM entries").fetchone()
+
+
+# 所有标签及其日记数（按名称排序）
+@perf.timed
+@cached_query
+def get_tag_counts():
+    with connection() as conn:
+        return conn.execute("SELECT name, entry_count FROM tags WHERE entry_count > 0 ORDER BY name").fetchall()
+
+
+# 已保存的日记中出现过的心情（来自按月心情计数，不扫描日记）
+@perf.timed
+@cached_query
+def get_moods():
+    with connection() as conn:
+        return [row[0] for row in conn.execute("SELECT DISTINCT mood FROM mood_monthly WHERE entry_count > 0 ORDER BY mood")]
+
+
+# 每月各心情的日记数：[(月份, 心情, 日记数)]
+@perf.timed
+@cached_query
+def get_mood_monthly():
+    with connection() as conn:
+        return conn.execute("SELECT month, mood, entry_count FROM mood_monthly WHERE entry_count > 0 ORDER BY month").fetchall()
+
+
+# 每周的日记数：[(周一日期, 日记数)]
+@perf.timed
+@cached_query
+def get_weekly_counts():
+    with connection() as conn:
+        return conn.execute("SELECT week, entry_count FROM weekly_counts WHERE entry_count > 0 ORDER BY week").fetchall()
+
+
+# 写过日记的日期（升序）
+@perf.timed
+@cached_query
+def get_written_days():
+    with connection() as conn:
+        return [row[0] for row in conn.execute("SELECT date FROM daily_summary ORDER BY date")]
+
+
+# 使用最多的标签：[(标签, 日记数)]
+@perf.timed
+@cached_query
+def get_top_tags(limit=10):
+    with connection() as conn:
+        return conn.execute("SELECT name, entry_count FROM tags WHERE entry_count > 0 ORDER BY entry_count DESC LIMIT ?",
+                            (limit,)).fetchall()
+
+
+# 根据筛选条件生成 WHERE 子句
+# match_all 为 True 时要求包含所有选中的标签，否则包含任意一个即可
+def _filter_clause(start_date, end_date, moods, tags, match_all=False):
+    where = ["date BETWEEN ? AND ?"]
+    params = [start_date, end_date]
+    if moods is not None:
+        where.append(f"mood IN ({', '.join('?' * len(moods))})")
+        params.extend(moods)
+    if tags:
+        tag_query = f'''SELECT et.entry_id FROM entry_tags et
+                         JOIN tags t ON t.id = et.tag_id
+                         WHERE t.name IN ({', '.join('?' * len(tags))})'''
+        params.extend(tags)
+        if match_all:
+            tag_query += " GROUP BY et.entry_id HAVING COUNT(*) = ?"
+            params.append(len(set(tags)))
+        where.append(f"id IN ({tag_query})")
+    return " AND ".join(where), params
+
+
+# 符合筛选条件的日记数
+@perf.timed
+@cached_query
+def count_entries(start_date, end_date, moods=None, tags=None, match_all=False):
+    where, params = _filter_clause(start_date, end_date, moods, tags, match_all)
+    with connection() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM entries WHERE {where}", params).fetchone()[0]
+
+
+# 按筛选条件分页获取日记（按日期和 id 倒序的键集分页，正文为预览）
+# after 为上一页最后一条日记的 (date, id)，为 None 时从第一页开始
+@perf.timed
+@cached_query
+def list_entries(start_date, end_date, moods=None, tags=None, match_all=False, after=None, limit=20):
+    where, params = _filter_clause(start_date, end_date, moods, tags, match_all)
+    if after is not None:
+        where += " AND (date, id) < (?, ?)"
+        params.extend(after)
+    params.append(limit)
+    with connection() as conn:
+        return conn.execute(f"""SELECT {LIST_COLUMNS} FROM entries WHERE {where}
+                                ORDER BY date DESC, id DESC LIMIT ?""", params).fetchall()
+
+
+# 获取日期范围内有日记的日期
+@perf.timed
+@cached_query
+def get_entry_dates(start_date, end_date):
+    with connection() as conn:
+        rows = conn.execute("SELECT date FROM daily_summary WHERE date BETWEEN ? AND ?",
+                            (start_date, end_date)).fetchall()
+    return [row[0] for row in rows]
+
+
+# 日期范围内每天的汇总：{日期: (日记数, 出现最多的心情)}
+@perf.timed
+@cached_query
+def get_daily_summary(start_date, end_date):
+    with connection() as conn:
+        rows = conn.execute("SELECT date, entry_count, mood FROM daily_summary WHERE date BETWEEN ? AND ?",
+                            (start_date, end_date)).fetchall()
+    return {date: (count, mood) for date, count, mood in rows}
+
+
+# 用 <mark> 标出文本中的关键词（不区分大小写）
+def _mark(text, query):
+    if not text:
+        return text
+    return re.sub(re.escape(query), lambda m: f"<mark>{m.group(0)}</mark>", text, flags=re.IGNORECASE)
+
+
+# 正文中第一次出现关键词的位置前后各 width 个字，关键词用 <mark> 标出
+def _snippet(text, query, width=32):
+    position = text.lower().find(query.lower())
+    if position < 0:
+        return text[:2 * width] + ("..." if len(text) > 2 * width else "")
+    start = max(position - width, 0)
+    end = position + len(query) + width
+    return ("..." if start else "") + _mark(text[start:end], query) + ("..." if end < len(text) else "")
+
+
+# 搜索日记（全文索引，按相关度排序），正文位置为预览
+# 3 个字及以上用 trigram 索引，两个字（都是文字）用两字词索引，只有单个字或含标点的两个字才扫描全表
+@perf.timed
+@cached_query
+def search_entries(query, limit=50):
+    with connection() as conn:
+        if len(query) >= 3:
+            # 整个关键词作为一个短语，trigram 索引可直接做子串匹配
+            match = '"' + query.replace('"', '""') + '"'
+            return conn.execute('''SELECT e.id, e.date,
+                                          highlight(entries_fts, 0, '<mark>', '</mark>'),
+                                          COALESCE(e.preview, e.content), e.mood, e.tags,
+                                          snippet(entries_fts, 1, '<mark>', '</mark>', '...', 64),
+                                          e.updated_at
+                                   FROM entries_fts
+                                   JOIN entries e ON e.id = entries_fts.rowid
+                                   WHERE entries_fts MATCH ?
+                                   ORDER BY bm25(entries_fts, 10.0, 1.0, 5.0)
+                                   LIMIT ?''', (match, limit)).fetchall()
+
+        if len(query) == 2 and _WORD_RUN.fullmatch(query):
+            # 两字词索引中每个两字词是一个词元，只需解压匹配到的日记来生成摘要
+            rows = conn.execute(f'''SELECT e.id, e.date, e.title, COALESCE(e.preview, e.content), e.mood, e.tags,
+                                             {_full_content_sql('e')}, e.updated_at
+                                      FROM entries_bigram_fts
+                                      JOIN entries e ON e.id = entries_bigram_fts.rowid
+                                      WHERE entries_bigram_fts MATCH ?
+                                      ORDER BY bm25(entries_bigram_fts, 10.0, 1.0, 5.0)
+                                      LIMIT ?''', ('"' + query.lower() + '"', limit)).fetchall()
+            return [(entry_id, date, _mark(title, query), preview, mood, tags, _snippet(content, query), updated_at)
+                    for entry_id, date, title, preview, mood, tags, content, updated_at in rows]
+
+        # 单个字（或含标点的两个字）无法使用索引，退回到 LIKE 匹配（需要解压正文）
+        pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        return conn.execute(f'''SELECT id, date, title, COALESCE(preview, content), mood, tags,
+                                      COALESCE(preview, content), updated_at
+                               FROM entries
+                               WHERE title LIKE ? ESCAPE '\\' OR tags LIKE ? ESCAPE '\\'
+                                  OR {_full_content_sql('entries')} LIKE ? ESCAPE '\\'
+                               ORDER BY date DESC
+                               LIMIT ?''', (pattern, pattern, pattern, limit)).fetchall()
@@ -0,0 +1,141 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import db
+
+# 同一篇草稿两次写入之间的最短间隔（秒），间隔内的修改合并为一次写入
+AUTOSAVE_INTERVAL = 3.0
+
+# 记住最近写入内容的草稿数（用于跳过没有变化的保存）
+SAVED_LIMIT = 1000
+
+# 浏览器端自动保存的令牌数上限（每个打开的编辑器一个），超出时删除最早的
+TOKEN_LIMIT = 10000
+
+# 等待写入的草稿：{(数据库文件, key): 草稿内容}，只保留最新的内容
+_pending = {}
+
+# 每篇草稿最后一次写入的时间，以及写入的内容
+_last_flush = {}
+_saved = OrderedDict()
+
+# 浏览器端自动保存的令牌：{令牌: (数据库文件, key, 日记 id, 日期, 心情)}
+# 令牌只能写入登记时的这一篇草稿，浏览器不能选择数据库文件或其他日记
+_tokens = OrderedDict()
+
+# 锁的顺序：_submit_lock 在 _cond 之前。_cond 只保护内存中的状态，持有时不等待写队列，
+# 浏览器请求（schedule_client，在服务器的事件循环中调用）不会因为写队列满而阻塞
+# _submit_lock 在交给写线程期间持有，discard 等待正在进行的提交完成
+_cond = threading.Condition()
+_submit_lock = threading.Lock()
+_saved_lock = threading.Lock()
+_thread = None
+
+
+# 记录草稿的最新内容，由后台线程按间隔写入（调用方不等待数据库）
+def schedule(path, key, entry_id, date, title, content, mood, tags):
+    with _cond:
+        _put((path, key), (entry_id, date, title, content, mood, tags))
+    _ensure_thread()
+
+
+# 记录草稿的最新内容，内容和上次写入的相同时不再写入（调用方持有 _cond）
+def _put(item, fields):
+    with _saved_lock:
+        unchanged = _saved.get(item) == fields
+    if unchanged:
+        _pending.pop(item, None)
+        return
+    _pending[item] = fields
+    _cond.notify()
+
+
+# 为编辑器登记浏览器端自动保存的令牌，返回令牌；token 仍有效时只更新日期和心情
+def register(path, key, entry_id, date, mood, token=None):
+    with _cond:
+        if token not in _tokens or _tokens[token][:2] != (path, key):
+            token = secrets.token_urlsafe(16)
+        _tokens[token] = (path, key, entry_id, date, mood)
+        _tokens.move_to_end(token)
+        while len(_tokens) > TOKEN_LIMIT:
+            _tokens.popitem(last=False)
+    return token
+
+
+# 浏览器提交的草稿内容（标题、正文、标签），令牌无效时返回 False
+# 新日记的标题和正文都为空时不保存
+def schedule_client(token, title, content, tags):
+    with _cond:
+        target = _tokens.get(token)
+        if target is None:
+            return False
+        path, key, entry_id, date, mood = target
+        if entry_id is None and not title and not content:
+            return True
+        _put((path, key), (entry_id, date, title, content, mood, tags))
+    _ensure_thread()
+    return True
+
+
+# 丢弃还没写入的草稿，并使这篇草稿的令牌失效（提交日记或取消编辑时调用，之后由调用方删除数据库中的草稿）
+# 在同一个锁内完成，之后到达的浏览器请求不会再写入这篇草稿；
+# 先等待后台线程正在进行的提交，保证这篇草稿的写入都排在调用方之后的删除之前
+def discard(path, key):
+    item = (path, key)
+    with _submit_lock, _cond:
+        _pending.pop(item, None)
+        for token in [token for token, target in _tokens.items() if target[:2] == item]:
+            del _tokens[token]
+    with _saved_lock:
+        _saved.pop(item, None)
+
+
+# 草稿写入完成后记住内容（在写线程中调用，不能等待 _cond，否则队列满时会互相等待）
+def _remember(item, fields, future):
+    if future.exception() is None:
+        with _saved_lock:
+            _saved[item] = fields
+            _saved.move_to_end(item)
+            while len(_saved) > SAVED_LIMIT:
+                _saved.popitem(last=False)
+
+
+# 后台线程：把到期的草稿交给写线程，未到期的等到间隔结束
+def _flush_loop():
+    while True:
+        with _cond:
+            while not _pending:
+                _cond.wait()
+            now = time.time()
+            # 不再有待写内容的草稿不需要记录写入时间
+            for item in [item for item, last in _last_flush.items()
+                         if now - last >= AUTOSAVE_INTERVAL and item not in _pending]:
+                del _last_flush[item]
+            due = [item for item in _pending if now - _last_flush.get(item, 0) >= AUTOSAVE_INTERVAL]
+            if not due:
+                _cond.wait(min(_last_flush[item] for item in _pending) + AUTOSAVE_INTERVAL - now)
+                continue
+        # 在 _cond 之外提交（写队列满时会等待）；持有 _submit_lock，期间被 discard 的草稿不会再提交
+        with _submit_lock:
+            with _cond:
+                batch = [(item, _pending.pop(item)) for item in due if item in _pending]
+                for item, fields in batch:
+                    _last_flush[item] = now
+            for item, fields in batch:
+                path, key = item
+                db.select_database(path)
+                future = db.save_draft_async(key, *fields)
+                future.add_done_callback(lambda f, item=item, fields=fields: _remember(item, fields, f))
+
+
+# 启动后台线程（只启动一次）
+def _ensure_thread():
+    global _thread
+    if _thread is not None:
+        return
+    with _cond:
+        if _thread is None:
+            _thread = threading.Thread(target=_flush_loop, name="diary-drafts", daemon=True)
+            _thread.start()
@@ -0,0 +1,204 @@
+import glob
+import os
+import sqlite3
+import threading
+import time
+
+import db
+
+# 备份文件夹（设置环境变量 DIARY_BACKUP_DIR 修改）
+BACKUP_DIR = os.environ.get("DIARY_BACKUP_DIR", "backups")
+
+# 自动备份间隔（秒），设置环境变量 DIARY_BACKUP_INTERVAL=0 关闭自动备份
+BACKUP_INTERVAL = int(os.environ.get("DIARY_BACKUP_INTERVAL", str(6 * 3600)))
+
+# 每个数据库保留的备份数，超出时删除最旧的
+BACKUP_KEEP = 7
+
+# 在线备份每步复制的页数和每步之间的停顿（秒），每步之间不占用数据库锁
+BACKUP_PAGES = 256
+BACKUP_SLEEP = 0.005
+
+# 优化（ANALYZE、PRAGMA optimize、搜索索引合并）的间隔（秒）
+MAINTENANCE_INTERVAL = 24 * 3600
+
+# 最后一次写入之后多少秒算空闲，只在空闲时做优化
+IDLE_SECONDS = 60
+
+# 后台线程检查的间隔（秒）
+CHECK_INTERVAL = 30
+
+# 需要合并的搜索索引（trigram 索引和两字词索引）
+FTS_TABLES = ["entries_fts", "entries_bigram_fts"]
+
+# 每次合并搜索索引时最多处理的页数，以及最多合并的次数
+FTS_MERGE_PAGES = 500
+FTS_MERGE_ROUNDS = 50
+
+# 每个数据库的最近一次备份和优化：{路径: {"backup": {...}, "maintenance": {...}}}
+_status = {}
+_status_lock = threading.Lock()
+
+# 备份和优化每次只做一项，避免同时占用磁盘
+_run_lock = threading.Lock()
+
+_scheduler_lock = threading.Lock()
+_scheduler_thread = None
+
+
+# 数据库的备份文件（从旧到新）
+def list_backups(path):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return sorted(glob.glob(os.path.join(BACKUP_DIR, glob.escape(stem) + "-????????-??????.db")))
+
+
+# 记录一次备份或优化的结果
+def _set_status(path, kind, **info):
+    with _status_lock:
+        _status.setdefault(path, {})[kind] = dict(info, time=time.time())
+
+
+# 数据库的备份和优化状态
+def status(path):
+    with _status_lock:
+        return dict(_status.get(path, {}))
+
+
+# 在线备份：分步复制页面，完成后改名为带时间戳的备份文件，并删除超出保留数的旧备份
+def backup_database(path):
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    target = os.path.join(BACKUP_DIR, f"{stem}-{time.strftime('%Y%m%d-%H%M%S')}.db")
+    partial = target + ".part"
+    start = time.perf_counter()
+    steps = 0
+
+    def progress(state, remaining, total):
+        nonlocal steps
+        steps += 1
+
+    with _run_lock:
+        try:
+            src = sqlite3.connect(path, isolation_level=None)
+            dst = sqlite3.connect(partial)
+            try:
+                # 先开启读事务：WAL 模式下整个备份读同一个快照，其他连接的写入不会让备份从头开始
+                src.execute("BEGIN")
+                src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                src.backup(dst, pages=BACKUP_PAGES, progress=progress, sleep=BACKUP_SLEEP)
+            finally:
+                dst.close()
+                src.close()
+            os.replace(partial, target)
+        except Exception as e:
+            if os.path.exists(partial):
+                os.remove(partial)
+            _set_status(path, "backup", ms=(time.perf_counter() - start) * 1000, error=str(e))
+            raise
+
+        backups = list_backups(path)
+        for old in backups[:-BACKUP_KEEP]:
+            os.remove(old)
+    _set_status(path, "backup", ms=(time.perf_counter() - start) * 1000, file=target,
+                size=os.path.getsize(target), steps=steps, error=None)
+    return target
+
+
+# 优化数据库：更新查询统计信息，分批合并搜索索引的段，并保存相关日记索引
+def optimize_database(path):
+    timings = {}
+    start = time.perf_counter()
+    with _run_lock:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA busy_timeout = 5000")
+            step = time.perf_counter()
+            conn.execute("ANALYZE")
+            timings["ANALYZE"] = (time.perf_counter() - step) * 1000
+
+            step = time.perf_counter()
+            conn.execute("PRAGMA optimize")
+            timings["optimize"] = (time.perf_counter() - step) * 1000
+
+            # 每次只合并一部分，两次之间其他连接可以写入；没有新的改动时说明已合并完
+            for table in FTS_TABLES:
+                if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).fetchone():
+                    continue
+                step = time.perf_counter()
+                for _ in range(FTS_MERGE_ROUNDS):
+                    before = conn.total_changes
+                    conn.execute(f"INSERT INTO {table} ({table}, rank) VALUES ('merge', {FTS_MERGE_PAGES})")
+                    if conn.total_changes - before < 2:
+                        break
+                timings[f"{table}_merge"] = (time.perf_counter() - step) * 1000
+
+            step = time.perf_counter()
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+            timings["checkpoint"] = (time.perf_counter() - step) * 1000
+
+            # 保存相关日记索引，重启后只需增量更新（related 依赖 numpy，用到时才导入）
+            import related
+            step = time.perf_counter()
+            if related.save(path):
+                timings["related_index"] = (time.perf_counter() - step) * 1000
+        except Exception as e:
+            _set_status(path, "maintenance", ms=(time.perf_counter() - start) * 1000, steps=timings, error=str(e))
+            raise
+        finally:
+            conn.close()
+    _set_status(path, "maintenance", ms=(time.perf_counter() - start) * 1000, steps=timings, error=None)
+    return timings
+
+
+# 最近一次成功执行的时间，失败的记录不算
+def _last_success(info, kind):
+    item = info.get(kind)
+    return item["time"] if item and not item["error"] else None
+
+
+# 执行到期的备份和优化（备份随时可以做，优化只在空闲时做）
+def run_due(path, now=None):
+    now = now or time.time()
+    info = status(path)
+
+    if BACKUP_INTERVAL:
+        last_backup = _last_success(info, "backup")
+        if last_backup is None:
+            # 重启后按已有的最新备份文件计算
+            backups = list_backups(path)
+            last_backup = os.path.getmtime(backups[-1]) if backups else 0
+        if now - last_backup >= BACKUP_INTERVAL:
+            backup_database(path)
+
+    last_maintenance = _last_success(info, "maintenance") or 0
+    if now - last_maintenance >= MAINTENANCE_INTERVAL and now - db.last_write_time(path) >= IDLE_SECONDS:
+        optimize_database(path)
+
+
+# 后台线程：定期检查当前打开的数据库，已关闭的数据库不再保留状态
+def _scheduler_loop():
+    while True:
+        time.sleep(CHECK_INTERVAL)
+        paths = db.open_paths()
+        with _status_lock:
+            for path in set(_status) - set(paths):
+                del _status[path]
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            try:
+                run_due(path)
+            except Exception:
+                # 错误已记录在状态中，下次检查时重试
+                pass
+
+
+# 启动后台维护线程（只启动一次）
+def start():
+    global _scheduler_thread
+    if _scheduler_thread is not None:
+        return
+    with _scheduler_lock:
+        if _scheduler_thread is None:
+            _scheduler_thread = threading.Thread(target=_scheduler_loop, name="diary-maintenance", daemon=True)
+            _scheduler_thread.start()
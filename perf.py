@@ -0,0 +1,132 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# 设置环境变量 DIARY_PROFILE=1 为所有会话开启性能记录（也可以在网址后加 ?profile=1 只为当前会话开启）
+ENABLED = os.environ.get("DIARY_PROFILE", "") not in ("", "0")
+
+# 设置 DIARY_PROFILE_LOG=文件路径 时，每次重跑的记录以 JSON 行追加到该文件
+LOG_PATH = os.environ.get("DIARY_PROFILE_LOG")
+
+# 每个操作保留最近多少次耗时，用于计算 p50/p95
+HISTORY_SIZE = 200
+
+# Streamlit 每次重跑在一个线程中执行，记录按线程保存
+_local = threading.local()
+_log_lock = threading.Lock()
+
+
+# 开始记录一次重跑
+def start_run(enabled=ENABLED):
+    _local.run = [] if enabled else None
+    _local.sql = None
+    _local.start = time.perf_counter()
+
+
+# 当前线程是否在记录
+def active():
+    return getattr(_local, "run", None) is not None
+
+
+# 结束记录，返回本次重跑的所有记录和总耗时（毫秒）
+def finish_run():
+    run = getattr(_local, "run", None)
+    total_ms = (time.perf_counter() - _local.start) * 1000 if run is not None else 0
+    _local.run = None
+    _local.sql = None
+    return run, total_ms
+
+
+# 添加一条记录
+def record(kind, name, ms, rows=None, sql=None):
+    run = getattr(_local, "run", None)
+    if run is not None:
+        run.append({"kind": kind, "name": name, "ms": round(ms, 3), "rows": rows, "sql": sql or []})
+
+
+# 记录一段页面代码的耗时
+@contextmanager
+def section(name):
+    if not active():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record("section", name, (time.perf_counter() - start) * 1000)
+
+
+# SQLite 的 trace 回调：收集当前数据库调用执行的 SQL
+def trace(statement):
+    buffer = getattr(_local, "sql", None)
+    if buffer is not None:
+        buffer.append(statement)
+
+
+# 结果的行数
+def _row_count(result):
+    if result is None:
+        return 0
+    if isinstance(result, (list, dict)):
+        return len(result)
+    return 1
+
+
+# 记录数据库调用的耗时、行数和执行的 SQL（没有 SQL 表示命中了查询缓存）
+def timed(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not active():
+            return func(*args, **kwargs)
+        outer = _local.sql
+        _local.sql = []
+        start = time.perf_counter()
+        result = None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            statements = _local.sql
+            _local.sql = outer
+            if outer is not None:
+                outer.extend(statements)
+            record("db", func.__name__, ms, _row_count(result), statements)
+    return wrapper
+
+
+# 把一次重跑的记录加入历史，history 为 {操作名: deque}
+def update_history(history, run):
+    for item in run:
+        key = f"{item['kind']}:{item['name']}"
+        history.setdefault(key, deque(maxlen=HISTORY_SIZE)).append(item["ms"])
+
+
+# 按操作计算次数、p50 和 p95（毫秒）
+def percentiles(history):
+    stats = []
+    for key, values in sorted(history.items()):
+        ordered = sorted(values)
+        n = len(ordered)
+        stats.append({
+            "操作": key,
+            "次数": n,
+            "p50": ordered[(n - 1) // 2],
+            "p95": ordered[min(n - 1, int(n * 0.95))],
+        })
+    return stats
+
+
+# 追加一条结构化日志
+def write_log(run, total_ms, **extra):
+    if not LOG_PATH or run is None:
+        return
+    line = json.dumps(dict(extra, time=time.time(), total_ms=round(total_ms, 3), records=run), ensure_ascii=False)
+    with _log_lock:
+        with open(LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
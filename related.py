@@ -0,0 +1,299 @@
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import db
+import perf
+
+# 单字的特征键为字符的码位（小于 2^21），相邻两字为 ((前一个字 + 1) << 21) | 后一个字，两者不会重复
+_CHAR_BITS = 21
+
+# 一批日记中 (第几篇, 特征键) 合并为一个整数时，特征键占的位数
+_KEY_BITS = 43
+
+# 每批向量化的日记数
+BATCH_SIZE = 1000
+
+# 内存中保留的索引数（多用户模式下每个数据库文件一个索引）
+MAX_INDEXES = 8
+
+# 删除和替换留下的空行中的非零元素超过这个比例时压缩矩阵
+COMPACT_RATIO = 0.25
+
+# 索引文件的格式版本，格式不同时重建索引
+FORMAT = 3
+
+# 标点和空白替换为空格，n-gram 不跨过它们
+_SEPARATORS = re.compile(r"[\W_]+")
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+# 一个数据库文件的稀疏 TF-IDF 索引：每篇日记一行词频，按 CSR 格式（indptr/indices/data）保存，数组按容量倍增
+# 词表为全部出现过的单字和相邻两字，不做哈希；IDF 随日记的增删而变化，所以只保存词频，查询时再按当前的 IDF 加权
+# 删除或替换日记时原来的行留空（词频置 0），空行较多时压缩
+class _Index:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # 每行的日记 id，行数（包括空行）和有效行数
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.rows = 0
+        self.size = 0
+        self.row_of = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.data = np.zeros(0, dtype=np.float32)
+        self.nnz = 0
+        # 空行中的非零元素数
+        self.dead = 0
+        # 词表：按特征键排序，以及每个键的列号（按首次出现的顺序分配）
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.columns = np.zeros(0, dtype=np.int32)
+        # 每一列出现在多少篇日记中，用于计算 IDF
+        self.df = np.zeros(0, dtype=np.float64)
+        # 按当前 IDF 加权后每行的长度，索引变化后重新计算
+        self.norms = None
+        # 已经索引到的修改序号（见 db 迁移 15），以及对应的数据版本
+        self.synced_seq = 0
+        self.version = None
+        self.dirty = False
+
+    # 行或非零元素的容量不足时扩大一倍
+    def _reserve(self, rows, nnz):
+        if rows > len(self.ids):
+            capacity = max(rows, 2 * len(self.ids), 1024)
+            self.ids = np.resize(self.ids, capacity)
+            self.indptr = np.resize(self.indptr, capacity + 1)
+        if nnz > len(self.indices):
+            capacity = max(nnz, 2 * len(self.indices), 1 << 16)
+            self.indices = np.resize(self.indices, capacity)
+            self.data = np.resize(self.data, capacity)
+
+    # 特征键对应的列号，词表中没有的键添加为新列
+    def _columns(self, keys):
+        unique, inverse = np.unique(keys, return_inverse=True)
+        pos = np.searchsorted(self.keys, unique)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == unique[found]
+        columns = np.empty(len(unique), dtype=np.int32)
+        columns[found] = self.columns[pos[found]]
+        added = np.arange(len(self.df), len(self.df) + np.count_nonzero(~found), dtype=np.int32)
+        columns[~found] = added
+        self.keys = np.insert(self.keys, pos[~found], unique[~found])
+        self.columns = np.insert(self.columns, pos[~found], added)
+        self.df = np.concatenate([self.df, np.zeros(len(added))])
+        return columns[inverse]
+
+    # 删除一行：词频置 0，行留空
+    def remove(self, entry_id):
+        row = self.row_of.pop(entry_id, None)
+        if row is None:
+            return
+        start, end = self.indptr[row], self.indptr[row + 1]
+        self.df[self.indices[start:end]] -= 1
+        self.data[start:end] = 0
+        self.dead += end - start
+        self.size -= 1
+        self.norms = None
+        self.dirty = True
+
+    # 添加或替换一批日记的词频：docs 为每个非零元素属于这批中的第几篇（已排序），keys 为特征键，tf 为词频
+    def upsert(self, entry_ids, docs, keys, tf):
+        for entry_id in entry_ids:
+            self.remove(entry_id)
+        if self.dead > COMPACT_RATIO * self.nnz:
+            self._compact()
+        columns = self._columns(keys)
+        self.df += np.bincount(columns, minlength=len(self.df))
+        rows, nnz = self.rows + len(entry_ids), self.nnz + len(keys)
+        self._reserve(rows, nnz)
+        self.ids[self.rows:rows] = entry_ids
+        self.indptr[self.rows + 1:rows + 1] = self.nnz + np.cumsum(np.bincount(docs, minlength=len(entry_ids)))
+        self.indices[self.nnz:nnz] = columns
+        self.data[self.nnz:nnz] = tf
+        for i, entry_id in enumerate(entry_ids):
+            self.row_of[entry_id] = self.rows + i
+        self.rows, self.nnz = rows, nnz
+        self.size += len(entry_ids)
+        self.norms = None
+        self.dirty = True
+
+    # 去掉空行（词表保持不变）
+    def _compact(self):
+        live = np.zeros(self.rows, dtype=bool)
+        live[list(self.row_of.values())] = True
+        lengths = np.diff(self.indptr[:self.rows + 1])
+        keep = np.repeat(live, lengths)
+        self.ids = self.ids[:self.rows][live]
+        self.indptr = np.concatenate([[0], np.cumsum(lengths[live])])
+        self.indices = self.indices[:self.nnz][keep]
+        self.data = self.data[:self.nnz][keep]
+        self.rows, self.nnz, self.dead = len(self.ids), len(self.indices), 0
+        self.row_of = {int(entry_id): row for row, entry_id in enumerate(self.ids)}
+
+    # 每行按 values（每个非零元素一个值）求和，空行为 0
+    def _row_sums(self, values):
+        starts = self.indptr[:self.rows]
+        sums = np.add.reduceat(np.append(values, np.float32(0)), starts)
+        sums[starts == self.indptr[1:self.rows + 1]] = 0
+        return sums
+
+    # 某一行与所有行的余弦相似度（按当前的 IDF 加权）：
+    # 每个非零元素乘以查询行同一列的 tf·w²，再按行求和，不需要生成加权后的矩阵
+    def similarities(self, row):
+        weights = idf(self.df, self.size)
+        indices, data = self.indices[:self.nnz], self.data[:self.nnz]
+        if self.norms is None:
+            self.norms = np.sqrt(self._row_sums(np.square(data * weights[indices])))
+        start, end = self.indptr[row], self.indptr[row + 1]
+        query = np.zeros(len(weights), dtype=np.float32)
+        query[indices[start:end]] = data[start:end] * np.square(weights[indices[start:end]])
+        scores = self._row_sums(data * query[indices])
+        return scores / np.maximum(self.norms * self.norms[row], 1e-12)
+
+
+# 逆文档频率（平滑）
+def idf(df, n_docs):
+    return (np.log((1 + n_docs) / (1 + df)) + 1).astype(np.float32)
+
+
+# 一批文本的词频：(docs, keys, tf)，每个非零元素一项，按 (第几篇, 特征键) 排序
+# 特征为单字和相邻两字，对数词频
+def vectorize(texts):
+    cleaned = [_SEPARATORS.sub(" ", text.lower()) for text in texts]
+    joined = " ".join(cleaned) + " "
+    codes = np.frombuffer(joined.encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+    # 每个字符属于第几篇（篇与篇之间是空格，不会组成 n-gram）
+    lengths = np.array([len(text) + 1 for text in cleaned])
+    doc = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+    is_char = codes != ord(" ")
+
+    pairs = is_char[:-1] & is_char[1:]
+    bigrams = ((codes[:-1][pairs] + 1) << _CHAR_BITS) | codes[1:][pairs]
+    keys = np.concatenate([codes[is_char], bigrams])
+    docs = np.concatenate([doc[is_char], doc[:-1][pairs]])
+    combined, counts = np.unique((docs << _KEY_BITS) | keys, return_counts=True)
+    return combined >> _KEY_BITS, combined & ((1 << _KEY_BITS) - 1), np.log1p(counts).astype(np.float32)
+
+
+# 用于计算相似度的文本：标题、正文和标签
+def _entry_text(title, content, tags):
+    return f"{title} {content} {tags or ''}"
+
+
+# 索引文件的路径
+def _index_file(path):
+    return path + ".related.npz"
+
+
+# 从磁盘加载之前保存的索引，没有或格式不同（旧版本保存的是哈希向量）时返回空索引
+def _load(path):
+    index = _Index(path)
+    try:
+        with np.load(_index_file(path)) as data:
+            if int(data["format"]) != FORMAT:
+                return index
+            index.ids = data["ids"]
+            index.indptr = data["indptr"]
+            index.indices = data["indices"]
+            index.data = data["data"]
+            index.keys = data["keys"]
+            index.columns = data["columns"]
+            index.df = data["df"].astype(np.float64)
+            index.synced_seq = int(data["synced_seq"])
+    except (OSError, KeyError, ValueError):
+        return _Index(path)
+    index.rows = index.size = len(index.ids)
+    index.nnz = len(index.indices)
+    index.row_of = {int(entry_id): row for row, entry_id in enumerate(index.ids)}
+    return index
+
+
+# 把索引保存到数据库文件旁边（先去掉空行），重启后只需处理之后修改的日记
+def save(path):
+    with _indexes_lock:
+        index = _indexes.get(path)
+    if index is None or not index.dirty:
+        return False
+    with index.lock:
+        if index.dead:
+            index._compact()
+        target = _index_file(path)
+        partial = target + ".part.npz"
+        np.savez(partial, format=FORMAT, ids=index.ids[:index.rows], indptr=index.indptr[:index.rows + 1],
+                 indices=index.indices[:index.nnz], data=index.data[:index.nnz], keys=index.keys,
+                 columns=index.columns, df=index.df, synced_seq=index.synced_seq)
+        os.replace(partial, target)
+        index.dirty = False
+    return True
+
+
+# 当前数据库的索引（不存在时从磁盘加载），超出 MAX_INDEXES 时丢弃最久未使用的
+def _get_index(path):
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is not None:
+            _indexes.move_to_end(path)
+            return index
+    index = _load(path)
+    with _indexes_lock:
+        index = _indexes.setdefault(path, index)
+        _indexes.move_to_end(path)
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+# 把上次同步之后新增、修改和删除的日记更新到索引中（增量，不重建），返回是否为首次建立
+def _sync(index):
+    version = db.data_version()
+    if index.version == version:
+        return False
+    built = index.size == 0
+    with db.connection() as conn:
+        # 按修改序号分批读取：序号在写事务内分配，之后提交的日记序号一定更大，不会漏掉
+        while True:
+            rows = conn.execute(f'''SELECT id, title, {db._full_content_sql('entries')}, tags, change_seq FROM entries
+                                    WHERE change_seq > ? ORDER BY change_seq LIMIT ?''',
+                                (index.synced_seq, BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+            index.upsert([row[0] for row in rows], *vectorize([_entry_text(*row[1:4]) for row in rows]))
+            index.synced_seq = rows[-1][4]
+
+        # 日记数不一致说明有日记被删除
+        count = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count != index.size:
+            existing = np.array([row[0] for row in conn.execute("SELECT id FROM entries")], dtype=np.int64)
+            for entry_id in np.setdiff1d(np.array(list(index.row_of), dtype=np.int64), existing):
+                index.remove(int(entry_id))
+    index.version = version
+    return built and index.size > 0
+
+
+# 与某篇日记最相似的 k 篇日记：[(日记 id, 相似度)]，按相似度从高到低
+@perf.timed
+def related_entries(entry_id, k=5):
+    index = _get_index(db.current_path())
+    with index.lock:
+        built = _sync(index)
+        row = index.row_of.get(entry_id)
+        if row is None or index.size < 2:
+            return []
+        # 空行的相似度为 0，不会出现在结果中
+        scores = index.similarities(row)
+        scores[row] = -math.inf
+        k = min(k, index.rows - 1)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        result = [(int(index.ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+    # 首次建立索引后马上保存，之后的修改在后台维护时保存
+    if built:
+        save(index.path)
+    return result
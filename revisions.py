@@ -0,0 +1,125 @@
+import difflib
+import json
+import os
+import re
+import zlib
+
+# 字段之间的分隔符（单元分隔符，正常输入中不会出现）
+SEPARATOR = "\x1f"
+
+# 差异按行计算后，替换的行去掉相同的开头和结尾，剩下的部分不超过这么多字符时再按字符细分
+CHAR_DIFF_LIMIT = 2000
+
+# 按行比较时的切分位置：换行和中文句末标点之后（中文日记一段常常很长，一段就是一行）
+_SPLIT = re.compile(r"(?<=[\n。！？])")
+
+# 短于这个长度的相同片段直接作为插入文本保存，比记录位置更省空间
+MIN_COPY = 8
+
+
+# 把一个版本的字段合并为一段文本
+def pack_version(title, content, mood, tags):
+    return SEPARATOR.join([title or "", mood or "", tags or "", content or ""])
+
+
+# 拆分版本文本：(title, content, mood, tags)
+def unpack_version(text):
+    title, mood, tags, content = text.split(SEPARATOR, 3)
+    return title, content, mood, tags
+
+
+# 追加一个复制片段 [起点, 终点]，与前一个片段相连时合并
+def _copy(ops, start, end):
+    if end - start < MIN_COPY:
+        return False
+    if ops and isinstance(ops[-1], list) and ops[-1][1] == start:
+        ops[-1][1] = end
+    else:
+        ops.append([start, end])
+    return True
+
+
+# 追加一段插入文本，与前一段插入文本合并
+def _insert(ops, text):
+    if not text:
+        return
+    if ops and isinstance(ops[-1], str):
+        ops[-1] += text
+    else:
+        ops.append(text)
+
+
+# 把文本切分为行和句子（保留换行和标点）
+def _split(text):
+    return [part for part in _SPLIT.split(text) if part]
+
+
+# 追加替换的片段：old_text 从 base 的 start 处开始，替换为 new_text
+# 相同的开头和结尾直接复制，中间改动的部分较短时再按字符比较，较长时作为插入文本保存
+def _replace(ops, start, old_text, new_text):
+    prefix = len(os.path.commonprefix([old_text, new_text]))
+    suffix = len(os.path.commonprefix([old_text[prefix:][::-1], new_text[prefix:][::-1]]))
+    old_end, new_end = len(old_text) - suffix, len(new_text) - suffix
+    opcodes = [("equal", 0, prefix, 0, prefix)]
+    if old_end - prefix + new_end - prefix <= CHAR_DIFF_LIMIT:
+        matcher = difflib.SequenceMatcher(None, old_text[prefix:old_end], new_text[prefix:new_end], autojunk=False)
+        opcodes.extend((tag, k1 + prefix, k2 + prefix, l1 + prefix, l2 + prefix)
+                       for tag, k1, k2, l1, l2 in matcher.get_opcodes())
+    else:
+        opcodes.append(("replace", prefix, old_end, prefix, new_end))
+    opcodes.append(("equal", old_end, len(old_text), new_end, len(new_text)))
+    for tag, k1, k2, l1, l2 in opcodes:
+        if tag == "equal":
+            if not _copy(ops, start + k1, start + k2):
+                _insert(ops, old_text[k1:k2])
+        else:
+            _insert(ops, new_text[l1:l2])
+
+
+# 计算从 base 得到 target 的差异：列表中的 [起点, 终点] 表示复制 base 的片段，字符串表示插入的文本
+# 先按行和句子比较，再对改动的部分按字符比较，差异的大小与改动的多少成正比
+def diff(base, target):
+    ops = []
+    base_lines = _split(base)
+    target_lines = _split(target)
+    offsets = [0]
+    for line in base_lines:
+        offsets.append(offsets[-1] + len(line))
+
+    matcher = difflib.SequenceMatcher(None, base_lines, target_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        start, end = offsets[i1], offsets[i2]
+        new_text = "".join(target_lines[j1:j2])
+        if tag == "equal":
+            if not _copy(ops, start, end):
+                _insert(ops, base[start:end])
+        elif tag == "replace":
+            _replace(ops, start, base[start:end], new_text)
+        else:
+            _insert(ops, new_text)
+    return ops
+
+
+# 把差异应用到 base 上
+def patch(base, ops):
+    return "".join(base[op[0]:op[1]] if isinstance(op, list) else op for op in ops)
+
+
+# 差异编码为压缩的 JSON
+def encode_delta(ops):
+    return zlib.compress(json.dumps(ops, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+# 解码差异
+def decode_delta(data):
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+# 完整版本编码为压缩文本
+def encode_full(text):
+    return zlib.compress(text.encode("utf-8"))
+
+
+# 解码完整版本
+def decode_full(data):
+    return zlib.decompress(data).decode("utf-8")
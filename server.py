@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import re
+
+import streamlit as st
+from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.routing import Route
+from streamlit import file_util
+
+import assets
+import drafts
+
+# 启动方式：streamlit run server.py（与 streamlit run daily.py 相同，另外提供 PWA 的清单、图标、service worker
+# 和浏览器端自动保存草稿的 /drafts）
+# 这些文件都要在网站根路径下：service worker 只能控制它所在路径之下的页面
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 图标的网址前缀（/static/ 由 Streamlit 保留）
+ICONS_URL = "/icons/"
+
+# 内容不会改变的文件缓存一年，清单和 service worker 每次都向服务器确认
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+NO_CACHE = "no-cache"
+
+# 浏览器端自动保存草稿的请求体最大字节数
+MAX_DRAFT_BODY = 4 * 1024 * 1024
+
+
+# Streamlit 页面（应用外壳）引用的入口脚本、样式和字体，文件名都带内容哈希
+def shell_assets():
+    with open(os.path.join(file_util.get_static_dir(), "index.html"), encoding="utf-8") as f:
+        html = f.read()
+    return sorted(set("/" + path for path in re.findall(r'(?:src|href)="\./(static/[^"]+)"', html)))
+
+
+# 清单：图标换成带版本号的文件
+def build_manifest(asset_map):
+    with open(os.path.join(BASE_DIR, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["icons"] = [dict(icon, src=ICONS_URL + asset_map[icon["src"]])
+                         for icon in manifest["icons"] if icon["src"] in asset_map]
+    return manifest
+
+
+# service worker：填入缓存版本和预先缓存的文件，外壳、图标或脚本本身变化时版本随之变化
+def build_service_worker(asset_map):
+    with open(os.path.join(BASE_DIR, "service-worker.js"), encoding="utf-8") as f:
+        template = f.read()
+    precache = ["/", "/favicon.png", "/manifest.json"] + [ICONS_URL + name for name in sorted(asset_map.values())]
+    precache += shell_assets()
+    version = hashlib.sha256((template + json.dumps(precache)).encode("utf-8")).hexdigest()[:12]
+    return (template.replace("__VERSION__", version)
+            .replace("__PRECACHE__", json.dumps(precache, indent=2)))
+
+
+ASSET_MAP = assets.load_asset_map(os.path.join(BASE_DIR, assets.OUTPUT_DIR))
+MANIFEST = build_manifest(ASSET_MAP)
+SERVICE_WORKER = build_service_worker(ASSET_MAP)
+
+
+# /manifest.json
+async def manifest(request):
+    return JSONResponse(MANIFEST, media_type="application/manifest+json", headers={"Cache-Control": NO_CACHE})
+
+
+# /service-worker.js
+async def service_worker(request):
+    return Response(SERVICE_WORKER, media_type="text/javascript", headers={"Cache-Control": NO_CACHE})
+
+
+# /icons/<带版本号的文件名>，只提供清单中的文件
+async def icon(request):
+    name = request.path_params["name"]
+    if name not in ASSET_MAP.values():
+        return Response(status_code=404)
+    return FileResponse(os.path.join(BASE_DIR, assets.OUTPUT_DIR, name), media_type="image/png",
+                        headers={"Cache-Control": IMMUTABLE_CACHE})
+
+
+# /drafts：编辑器页面中的脚本提交的草稿 {"token", "title", "content", "tags"}（见 daily.DRAFT_SCRIPT）
+# 只记录到内存，由 drafts 的后台线程按间隔写入；令牌无效（日记已提交或编辑器已关闭）时返回 404
+async def save_draft(request):
+    body = await request.body()
+    if len(body) > MAX_DRAFT_BODY:
+        return Response(status_code=413)
+    try:
+        data = json.loads(body)
+        token = data["token"]
+        title, content, tags = (data.get(name, "") for name in ("title", "content", "tags"))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return Response(status_code=400)
+    if not all(isinstance(value, str) for value in (token, title, content, tags)):
+        return Response(status_code=400)
+    if not drafts.schedule_client(token, title, content, tags):
+        return Response(status_code=404)
+    return Response(status_code=204)
+
+
+app = st.App("daily.py", routes=[
+    Route("/manifest.json", manifest),
+    Route("/service-worker.js", service_worker),
+    Route(ICONS_URL + "{name}", icon),
+    Route("/drafts", save_draft, methods=["POST"]),
+])
@@ -1,7 +1,71 @@
+// 由 server.py 在提供这个文件时填入：缓存版本（应用外壳或图标变化时改变）和需要预先缓存的文件
+const VERSION = '__VERSION__';
+const PRECACHE = __PRECACHE__;
+
+const CACHE_PREFIX = 'diary-';
+const CACHE = CACHE_PREFIX + VERSION;
+
+// 数据和实时连接始终走网络
+const NETWORK_ONLY = ['/_stcore/', '/media/', '/component/'];
+
+// 内容带哈希的静态文件，缓存后永不改变
+const IMMUTABLE = ['/static/', '/icons/'];
+
+// 安装：预先缓存应用外壳、Streamlit 的入口脚本和样式、清单和图标
 self.addEventListener('install', function(event) {
-  event.waitUntil(self.skipWaiting());
+  event.waitUntil(
+    caches.open(CACHE)
+      .then(function(cache) { return cache.addAll(PRECACHE); })
+      .then(function() { return self.skipWaiting(); })
+  );
 });
 
+// 激活：删除旧版本的缓存
 self.addEventListener('activate', function(event) {
-  event.waitUntil(self.clients.claim());
-});
\ No newline at end of file
+  event.waitUntil(
+    caches.keys()
+      .then(function(keys) {
+        return Promise.all(keys
+          .filter(function(key) { return key.startsWith(CACHE_PREFIX) && key !== CACHE; })
+          .map(function(key) { return caches.delete(key); }));
+      })
+      .then(function() { return self.clients.claim(); })
+  );
+});
+
+// 先查缓存：页面导航都返回缓存的应用外壳（网址参数由页面自己处理），
+// 带哈希的静态文件第一次加载后放入缓存，其他请求直接走网络
+self.addEventListener('fetch', function(event) {
+  const request = event.request;
+  const url = new URL(request.url);
+  if (request.method !== 'GET' || url.origin !== self.location.origin) {
+    return;
+  }
+  if (NETWORK_ONLY.some(function(prefix) { return url.pathname.startsWith(prefix); })) {
+    return;
+  }
+
+  if (request.mode === 'navigate') {
+    event.respondWith(
+      caches.match('/', {cacheName: CACHE}).then(function(cached) {
+        return cached || fetch(request);
+      })
+    );
+    return;
+  }
+
+  event.respondWith(
+    caches.match(request, {cacheName: CACHE}).then(function(cached) {
+      if (cached) {
+        return cached;
+      }
+      return fetch(request).then(function(response) {
+        if (response.ok && IMMUTABLE.some(function(prefix) { return url.pathname.startsWith(prefix); })) {
+          const copy = response.clone();
+          caches.open(CACHE).then(function(cache) { cache.put(request, copy); });
+        }
+        return response;
+      });
+    })
+  );
+});
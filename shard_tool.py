@@ -0,0 +1,116 @@
+import argparse
+import os
+import re
+import shutil
+import sqlite3
+import sys
+
+import db
+
+# 分片文件名：<用户名>-<哈希前 8 位>.db，所在子目录为哈希前 2 位
+SHARD_NAME = re.compile(r"^.+-([0-9a-f]{8})\.db$")
+
+
+# 列出分片目录中的所有数据库文件
+def iter_shards(shards_dir):
+    for root, _, files in os.walk(shards_dir):
+        for name in sorted(files):
+            if SHARD_NAME.match(name):
+                yield os.path.join(root, name)
+
+
+# 用 SQLite 备份接口把数据库复制到新文件（源数据库可以同时在使用）
+def copy_database(source, target):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst, pages=1024)
+    finally:
+        dst.close()
+        src.close()
+
+
+# 把 WAL 中的内容写回数据库文件，之后只需移动 .db 文件本身
+def checkpoint(path):
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+# 把原来的单个数据库复制为某个用户的分片，并升级到最新的表结构
+def migrate(source, user, shards_dir, force=False):
+    target = db.shard_path(user, shards_dir)
+    if os.path.exists(target) and not force:
+        raise SystemExit(f"分片已存在：{target}（使用 --force 覆盖）")
+    copy_database(source, target)
+    db.use_database(target)
+    db.init_db()
+    with db.connection() as conn:
+        count = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+    db.close_all()
+    return target, count
+
+
+# 把不在正确子目录中的分片移动到按哈希划分的位置（应用停止时运行）
+def rebalance(shards_dir, dry_run=False):
+    moved = []
+    for path in list(iter_shards(shards_dir)):
+        digest = SHARD_NAME.match(os.path.basename(path)).group(1)
+        target = os.path.join(shards_dir, digest[:2], os.path.basename(path))
+        if os.path.abspath(path) == os.path.abspath(target):
+            continue
+        if os.path.exists(target):
+            print(f"跳过 {path}：目标已存在 {target}", file=sys.stderr)
+            continue
+        if not dry_run:
+            checkpoint(path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(path, target)
+        moved.append((path, target))
+    return moved
+
+
+# 命令行入口
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多用户分片管理")
+    parser.add_argument("--dir", default=db.SHARDS_DIR, help="分片目录（默认取环境变量 DIARY_SHARDS_DIR）")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_migrate = sub.add_parser("migrate", help="把单个数据库文件迁移为某个用户的分片")
+    p_migrate.add_argument("--user", required=True)
+    p_migrate.add_argument("--source", default=db.DB_PATH, help="原数据库文件")
+    p_migrate.add_argument("--force", action="store_true", help="覆盖已存在的分片")
+
+    p_rebalance = sub.add_parser("rebalance", help="把分片移动到按哈希划分的子目录")
+    p_rebalance.add_argument("--dry-run", action="store_true", help="只显示要移动的文件")
+
+    sub.add_parser("list", help="列出所有分片")
+    args = parser.parse_args(argv)
+    if not args.dir:
+        parser.error("请用 --dir 或环境变量 DIARY_SHARDS_DIR 指定分片目录")
+
+    if args.command == "migrate":
+        target, count = migrate(args.source, args.user, args.dir, args.force)
+        print(f"已迁移 {count} 篇日记到 {target}")
+    elif args.command == "rebalance":
+        moved = rebalance(args.dir, args.dry_run)
+        for path, target in moved:
+            print(f"{path} -> {target}")
+        print(f"{'需要' if args.dry_run else '已'}移动 {len(moved)} 个分片")
+    else:
+        total = 0
+        for path in iter_shards(args.dir):
+            size = os.path.getsize(path)
+            total += size
+            print(f"{size / 1024:>10.1f} KB  {os.path.relpath(path, args.dir)}")
+        print(f"共 {total / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()